@@ -1,117 +1,355 @@
+"""
+Batch renderer of static maps for sharing outside the dashboards.
+
+Writes one standalone HTML map per dataset x year x patient type x
+visualization (heatmap, location markers, hex bins) to static_maps/.
+The records are loaded and aggregated into a pincode cube once; every
+combination is then a slice of the cube placed at the post-office centroid
+of each pincode (see pincode_lookup.py), and the folium builds and HTML
+writes are spread over a process pool.
+
+Each output is keyed by a hash of its inputs (the combination's points, the
+render settings and the code of the renderer), so repeat runs skip the maps
+whose inputs have not changed. static_maps/manifest.json lists every map
+with its inputs hash and timings. The all-years address heatmap is also
+copied to address_heatmap.html, the single map this script used to write.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
 import folium
-from folium.plugins import HeatMap
-
-print("Loading CSV files...")
-
-# Load the address details
-address_df = pd.read_csv('Address Details.csv')
-print(f"Loaded {len(address_df)} address records")
-
-# Load the pincode lat/long reference data
-pincode_df = pd.read_csv('pincode_with_lat-long.csv', low_memory=False)
-print(f"Loaded {len(pincode_df)} pincode records")
-
-print("\nData Preview:")
-print("\nAddress Details columns:", address_df.columns.tolist())
-print("Address Details sample:")
-print(address_df.head())
-
-print("\nPincode Data columns:", pincode_df.columns.tolist())
-print("Pincode Data sample:")
-print(pincode_df.head())
-
-# Clean the data
-print("\nCleaning data...")
-# Remove any leading/trailing whitespace and convert pincodes to integers
-address_df['CPA_PIN_CODE'] = pd.to_numeric(address_df['CPA_PIN_CODE'], errors='coerce')
-pincode_df['Pincode'] = pd.to_numeric(pincode_df['Pincode'], errors='coerce')
-
-# Convert Latitude and Longitude to numeric (handle mixed types)
-pincode_df['Latitude'] = pd.to_numeric(pincode_df['Latitude'], errors='coerce')
-pincode_df['Longitude'] = pd.to_numeric(pincode_df['Longitude'], errors='coerce')
-
-# Drop rows with missing pincodes
-address_df = address_df.dropna(subset=['CPA_PIN_CODE'])
-pincode_df = pincode_df.dropna(subset=['Pincode', 'Latitude', 'Longitude'])
-
-print(f"After cleaning: {len(address_df)} address records, {len(pincode_df)} pincode records")
-
-# Merge the dataframes
-print("\nMerging data...")
-merged_df = address_df.merge(
-    pincode_df[['Pincode', 'Latitude', 'Longitude', 'OfficeName', 'District', 'StateName']],
-    left_on='CPA_PIN_CODE',
-    right_on='Pincode',
-    how='left'
-)
-
-# Check merge success
-print(f"Merged {len(merged_df)} records")
-print(f"Records with valid coordinates: {merged_df[['Latitude', 'Longitude']].notna().all(axis=1).sum()}")
-
-# Remove rows without coordinates
-merged_df = merged_df.dropna(subset=['Latitude', 'Longitude'])
-print(f"Final records with coordinates: {len(merged_df)}")
-
-# Aggregate data - count addresses per location
-print("\nAggregating data by location...")
-location_counts = merged_df.groupby(['Latitude', 'Longitude']).size().reset_index(name='count')
-print(f"Unique locations: {len(location_counts)}")
-print(f"Total addresses mapped: {location_counts['count'].sum()}")
-
-# Create the heatmap
-print("\nCreating heatmap...")
-
-# Calculate center of map based on data
-center_lat = location_counts['Latitude'].mean()
-center_lon = location_counts['Longitude'].mean()
-
-# Create base map
-m = folium.Map(
-    location=[center_lat, center_lon],
-    zoom_start=6,
-    tiles='OpenStreetMap'
-)
-
-# Prepare data for heatmap - [latitude, longitude, weight]
-heat_data = [
-    [row['Latitude'], row['Longitude'], row['count']]
-    for _, row in location_counts.iterrows()
-]
-
-# Add heatmap layer
-HeatMap(
-    heat_data,
-    min_opacity=0.3,
-    max_zoom=18,
-    radius=15,
-    blur=20,
-    gradient={
-        0.0: 'blue',
-        0.5: 'lime',
-        0.7: 'yellow',
-        1.0: 'red'
+
+from heat_layer import heat_points
+from hex_bins import hex_bins, hex_rings
+from map_layers import (CachedHeatMap, FeatureMarkerLayer, FeaturePolygonLayer, band_colors, feature_collection,
+                        format_percentages, polygon_collection)
+from pincode_cube import PincodeCube
+from pincode_data import SURGERY_FILE
+from pincode_lookup import load_centroid_lookup
+
+# The shareable address map is drawn from the address extract, not the dashboard's combined file
+ADDRESS_DETAILS_FILE = 'Address Details.csv'
+POST_OFFICE_FILE = 'pincode_with_lat-long.csv'
+OUTPUT_DIR = Path('static_maps')
+MANIFEST_FILE = 'manifest.json'
+
+# The address heatmap of all years, also kept at its original path
+ADDRESS_HEATMAP = ('address-all-years-all-types-heatmap.html', Path('address_heatmap.html'))
+
+# Modules whose code shapes the rendered maps, part of every inputs hash
+RENDER_MODULES = [Path(__file__), *(Path(__file__).with_name(name) for name in
+                                    ['heat_layer.py', 'hex_bins.py', 'map_layers.py'])]
+
+VIZ_TYPES = ['heatmap', 'markers', 'hexbins']
+
+DATASETS = {
+    'address': {
+        'file': ADDRESS_DETAILS_FILE,
+        'type_column': None,
+        'unit': 'customers',
+        'zoom': 6,
+        'hex_cell_km': 25,
+        'reference_latitude': 20.5937,
+    },
+    'surgery': {
+        'file': SURGERY_FILE,
+        'type_column': 'BSM_MINOR_CD',
+        'unit': 'patients',
+        'zoom': 11,
+        'hex_cell_km': 2,
+        'reference_latitude': 12.9716,
+    },
+}
+
+
+def load_records(csv_file, type_column=None):
+    """Pincode, registration year and patient type of every record with a valid pincode"""
+    columns = ['CPA_PIN_CODE', 'RegistrationDate'] + ([type_column] if type_column else [])
+    records = pd.read_csv(csv_file, usecols=columns)
+    records['CPA_PIN_CODE'] = pd.to_numeric(records['CPA_PIN_CODE'], errors='coerce')
+    records = records.dropna(subset=['CPA_PIN_CODE'])
+    records['Year'] = pd.to_datetime(records['RegistrationDate'], format='%d/%m/%y', errors='coerce').dt.year
+    if type_column:
+        records[type_column] = records[type_column].fillna('Unknown').astype(str).str.strip()
+    return records
+
+
+def pincode_locations(cube, centroids):
+    """Centroid, district and state of every pincode of the cube (NaN coordinates where unknown)"""
+    located = centroids.gather(cube.pincodes)
+    return pd.DataFrame({
+        'Pincode': cube.pincodes.astype(np.int64),
+        'Latitude': located['latitude'],
+        'Longitude': located['longitude'],
+        'District': centroids.city_labels(located['city']),
+        'StateName': centroids.state_labels(located['state']),
+    })
+
+
+def located_counts(cube, locations, year=None, patient_type=None):
+    """Pincodes of the selection with at least one record and a known centroid, with their count"""
+    counts = cube.pincode_counts(year, patient_type)
+    keep = (counts > 0) & locations['Latitude'].notna().to_numpy()
+    return locations.assign(count=counts)[keep].reset_index(drop=True)
+
+
+def _slug(value):
+    return re.sub(r'[^a-z0-9]+', '-', str(value).lower()).strip('-')
+
+
+def _code_hash():
+    """Content hash of the renderer modules, so editing them re-renders every map"""
+    digest = hashlib.sha1()
+    for path in RENDER_MODULES:
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def _inputs_hash(points, settings, code_hash):
+    """Hash of everything an output is rendered from"""
+    digest = hashlib.sha1(code_hash.encode('utf-8'))
+    digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(points, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def build_map(points, settings):
+    """Standalone folium map of one combination"""
+    unit, total = settings['unit'], settings['total']
+    m = folium.Map(
+        location=[points['Latitude'].mean(), points['Longitude'].mean()],
+        zoom_start=settings['zoom'],
+        tiles='OpenStreetMap',
+        control_scale=True
+    )
+
+    if settings['viz'] == 'heatmap':
+        CachedHeatMap(
+            heat_points(points['Latitude'], points['Longitude'], points['count'], weighting='log'),
+            min_opacity=0.3,
+            # Normalized weights reach full intensity from the opening zoom level
+            max_zoom=settings['zoom'],
+            radius=15,
+            blur=20,
+            gradient={
+                0.0: 'blue',
+                0.5: 'lime',
+                0.7: 'yellow',
+                1.0: 'red'
+            }
+        ).add_to(m)
+
+    elif settings['viz'] == 'markers':
+        # One marker per pincode, at the centroid of its post offices
+        counts = points['count'].to_numpy()
+        marker_data = feature_collection(points['Latitude'], points['Longitude'], {
+            'count': counts,
+            'pct_display': format_percentages(counts / total * 100),
+            'pincode': points['Pincode'],
+            'district': points['District'].astype(object).fillna(''),
+            'state': points['StateName'].astype(object).fillna(''),
+            'color': band_colors(counts, (1000, 500, 100), inclusive=False),
+        })
+        FeatureMarkerLayer(
+            marker_data,
+            circle_options={'radius': 6, 'color': '{color}', 'weight': 1, 'fillColor': '{color}', 'fillOpacity': 0.8},
+            tooltip_template="{pincode} {district} - {count} " + unit,
+            popup_template="""
+                <div style="font-family: Arial; width: 200px;">
+                    <h4 style="margin: 0; color: #1f77b4;">📍 {pincode}</h4>
+                    <hr style="margin: 5px 0;">
+                    <b>District:</b> {district}<br>
+                    <b>State:</b> {state}<br>
+                    <b>""" + unit.title() + """:</b> {count} ({pct_display})
+                </div>
+            """
+        ).add_to(m)
+
+    else:
+        bins = hex_bins(points['Latitude'], points['Longitude'], points['count'], settings['hex_cell_km'],
+                        reference_latitude=settings['reference_latitude'], total=total)
+        hex_data = polygon_collection(
+            hex_rings(bins, settings['hex_cell_km'], reference_latitude=settings['reference_latitude']), {
+                'count': bins['count'],
+                'pct_display': format_percentages(bins['percentage']),
+                'n_points': bins['n_points'],
+                'color': band_colors(bins['count'], (1000, 500, 100), inclusive=False),
+            })
+        FeaturePolygonLayer(
+            hex_data,
+            style_options={'color': '{color}', 'weight': 1, 'fillColor': '{color}', 'fillOpacity': 0.5},
+            tooltip_template="{n_points} pincodes - {count} " + unit + " ({pct_display})"
+        ).add_to(m)
+
+    title = f"{settings['title']} - {total:,} {unit}"
+    m.get_root().html.add_child(folium.Element(
+        '<div style="position: fixed; top: 10px; left: 60px; z-index: 1000; background: white; '
+        'padding: 6px 10px; border-radius: 4px; font-family: Arial; box-shadow: 0 0 6px rgba(0,0,0,0.3);">'
+        f'{title}</div>'
+    ))
+    return m
+
+
+def render_map(points, settings, path):
+    """Build one map and write it to `path`, returning its timings (runs in a worker process)"""
+    start = time.perf_counter()
+    html = build_map(points, settings).get_root().render()
+    built = time.perf_counter()
+
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    tmp_path.write_text(html, encoding='utf-8')
+    os.replace(tmp_path, path)
+    return {
+        'build_seconds': round(built - start, 3),
+        'write_seconds': round(time.perf_counter() - built, 3),
+        'bytes': len(html.encode('utf-8')),
+    }
+
+
+def plan_maps(datasets, centroids, code_hash):
+    """Every (dataset, file name, points, settings, inputs hash) to render, from one cube per dataset"""
+    jobs = []
+    for name in datasets:
+        config = DATASETS[name]
+        if not os.path.exists(config['file']):
+            print(f"⚠️  Skipping {name}: {config['file']} not found")
+            continue
+
+        records = load_records(config['file'], config['type_column'])
+        cube = PincodeCube(records, type_column=config['type_column'])
+        locations = pincode_locations(cube, centroids)
+        print(f"  - {name}: {len(records):,} records, {len(cube.pincodes):,} pincodes, {len(cube.years)} years")
+
+        types = [None] + list(cube.types) if config['type_column'] else [None]
+        for year in [None] + [int(year) for year in cube.years]:
+            for patient_type in types:
+                points = located_counts(cube, locations, year, patient_type)
+                if len(points) == 0:
+                    continue
+                title = f"{name.title()} · {year or 'All Years'} · {patient_type or 'All Types'}"
+                for viz in VIZ_TYPES:
+                    settings = {
+                        'viz': viz,
+                        'title': f"{title} · {viz.title()}",
+                        # Records of the selection, including those of pincodes without a centroid
+                        'total': int(cube.pincode_counts(year, patient_type).sum()),
+                        **{key: value for key, value in config.items() if key not in ('file', 'type_column')},
+                    }
+                    file_name = f"{name}-{year or 'all-years'}-{_slug(patient_type or 'all-types')}-{viz}.html"
+                    jobs.append((name, file_name, points, settings, _inputs_hash(points, settings, code_hash)))
+    return jobs
+
+
+def render_all(datasets=tuple(DATASETS), output_dir=OUTPUT_DIR, workers=None, force=False):
+    """Render every map whose inputs changed since the last run and write the manifest"""
+    print("=" * 60)
+    print("Static map batch render")
+    print("=" * 60)
+    run_start = time.perf_counter()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest_path = output_dir / MANIFEST_FILE
+    previous = {}
+    if manifest_path.exists():
+        try:
+            previous = {entry['file']: entry for entry in json.loads(manifest_path.read_text(encoding='utf-8'))['maps']}
+        except (ValueError, KeyError) as e:
+            print(f"⚠️  Ignoring unreadable manifest {manifest_path}: {e}")
+
+    # Load and aggregate once; the workers only receive the points of their map
+    print("\nLoading data...")
+    centroids = load_centroid_lookup(POST_OFFICE_FILE)
+    print(f"  - {int(np.isfinite(centroids.table['latitude']).sum()):,} pincode centroids")
+    jobs = plan_maps(datasets, centroids, _code_hash())
+    load_seconds = time.perf_counter() - run_start
+
+    # Maps of datasets not rendered this time are kept as they are
+    planned = {job[0] for job in jobs}
+    entries = {file_name: entry for file_name, entry in previous.items() if entry.get('dataset') not in planned}
+    pending = []
+    for dataset, file_name, points, settings, inputs in jobs:
+        entry = {
+            'file': file_name,
+            'dataset': dataset,
+            'title': settings['title'],
+            'inputs': inputs,
+            'points': len(points),
+            'total': settings['total'],
+        }
+        old = previous.get(file_name)
+        up_to_date = old is not None and old.get('inputs') == inputs and old.get('status') != 'failed'
+        if not force and up_to_date and (output_dir / file_name).exists():
+            entry.update({key: old[key] for key in ('build_seconds', 'write_seconds', 'bytes') if key in old})
+            entry['status'] = 'unchanged'
+        else:
+            pending.append((file_name, points, settings))
+        entries[file_name] = entry
+
+    print(f"\nRendering {len(pending)} of {len(jobs)} maps ({len(jobs) - len(pending)} unchanged)...")
+    render_start = time.perf_counter()
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(render_map, points, settings, output_dir / file_name): file_name
+                       for file_name, points, settings in pending}
+            for future in as_completed(futures):
+                file_name = futures[future]
+                try:
+                    entries[file_name].update(future.result(), status='rendered')
+                except Exception as e:
+                    print(f"❌ Failed to render {file_name}: {e}")
+                    entries[file_name]['status'] = 'failed'
+                    failed += 1
+    render_seconds = time.perf_counter() - render_start
+
+    # Maps of combinations that no longer exist (e.g. a year that was removed from the data)
+    for stale in set(previous) - set(entries):
+        (output_dir / stale).unlink(missing_ok=True)
+
+    map_name, copy_path = ADDRESS_HEATMAP
+    if 'address' in planned and (output_dir / map_name).exists():
+        shutil.copyfile(output_dir / map_name, copy_path)
+        print(f"\nAddress heatmap copied to: {copy_path}")
+
+    manifest = {
+        'generated': datetime.now().isoformat(timespec='seconds'),
+        'load_seconds': round(load_seconds, 3),
+        'render_seconds': round(render_seconds, 3),
+        'total_seconds': round(time.perf_counter() - run_start, 3),
+        'rendered': len(pending) - failed,
+        'unchanged': len(jobs) - len(pending),
+        'failed': failed,
+        'maps': sorted(entries.values(), key=lambda entry: entry['file']),
     }
-).add_to(m)
-
-# Save the map
-output_file = 'address_heatmap.html'
-m.save(output_file)
-print(f"\nHeatmap saved to: {output_file}")
-
-# Print statistics
-print("\nStatistics:")
-print(f"- Total unique locations: {len(location_counts)}")
-print(f"- Total addresses: {location_counts['count'].sum()}")
-print(f"- Average addresses per location: {location_counts['count'].mean():.2f}")
-print(f"- Max addresses at one location: {location_counts['count'].max()}")
-print(f"- Map center: ({center_lat:.4f}, {center_lon:.4f})")
-
-# Show top 10 locations
-print("\nTop 10 locations by address count:")
-top_locations = merged_df.groupby(['CPA_ADDR_CITY', 'CPA_PIN_CODE', 'Latitude', 'Longitude']).size().reset_index(name='count').sort_values('count', ascending=False).head(10)
-for idx, row in top_locations.iterrows():
-    print(f"  {row['CPA_ADDR_CITY']}, PIN: {int(row['CPA_PIN_CODE'])} - {row['count']} addresses")
-
-print("\nDone! Open 'address_heatmap.html' in a web browser to view the heatmap.")
+    tmp_path = manifest_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    os.replace(tmp_path, manifest_path)
+
+    print(f"\n✅ Rendered {manifest['rendered']} maps, {manifest['unchanged']} unchanged, {failed} failed")
+    print(f"   Load {load_seconds:.1f}s, render {render_seconds:.1f}s, total {manifest['total_seconds']:.1f}s")
+    print(f"   Manifest: {manifest_path}")
+    print("=" * 60)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render static maps for every dataset, year, patient type and visualization")
+    parser.add_argument('--datasets', nargs='+', choices=list(DATASETS), default=list(DATASETS),
+                        help="datasets to render (default: all)")
+    parser.add_argument('--output-dir', default=str(OUTPUT_DIR), help="folder for the HTML maps and the manifest")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per CPU)")
+    parser.add_argument('--force', action='store_true', help="re-render maps whose inputs have not changed")
+    args = parser.parse_args()
+    render_all(args.datasets, args.output_dir, args.workers, args.force)
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import googlemaps
 from dotenv import load_dotenv
@@ -5,6 +6,8 @@ import os
 import time
 from pathlib import Path
 
+from merge_addresses import SOURCE_FILES, unique_pincodes
+
 # Load environment variables
 load_dotenv()
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
@@ -77,27 +80,22 @@ def main():
     # Load address data from all CSV files
     print("\nLoading address data...")
 
-    # List of CSV files to process
-    csv_files = ['Address Details.csv', 'TNAddress.csv']
-    all_pincodes = set()
+    # Stream only the pincode column of each file, keeping a compact sorted int array
+    all_pincodes = np.empty(0, dtype=np.int64)
 
-    for csv_file in csv_files:
+    for csv_file in SOURCE_FILES:
         if Path(csv_file).exists():
-            df = pd.read_csv(csv_file)
-            df['CPA_PIN_CODE'] = pd.to_numeric(df['CPA_PIN_CODE'], errors='coerce')
-            df = df.dropna(subset=['CPA_PIN_CODE'])
-            pincodes = set(df['CPA_PIN_CODE'].unique())
-            all_pincodes.update(pincodes)
-            print(f"  - {csv_file}: {len(df)} records, {len(pincodes)} unique pincodes")
+            records, pincodes = unique_pincodes(csv_file)
+            all_pincodes = np.union1d(all_pincodes, pincodes)
+            print(f"  - {csv_file}: {records} records, {len(pincodes)} unique pincodes")
         else:
             print(f"  - {csv_file}: NOT FOUND (skipping)")
 
     # Get unique pincodes across all files
-    unique_pincodes = sorted(all_pincodes)
-    print(f"\nTotal unique pincodes across all files: {len(unique_pincodes)}")
+    print(f"\nTotal unique pincodes across all files: {len(all_pincodes)}")
 
     # Filter out already cached pincodes
-    pincodes_to_fetch = [p for p in unique_pincodes if p not in cached_pincodes]
+    pincodes_to_fetch = np.setdiff1d(all_pincodes, np.array(sorted(cached_pincodes), dtype=np.int64))
     print(f"Need to fetch {len(pincodes_to_fetch)} pincodes from Google Maps API")
 
     if len(pincodes_to_fetch) == 0:
@@ -0,0 +1,116 @@
+"""
+Heatmap points for the HeatMap layers, built with NumPy.
+
+Coordinates are quantized to `precision` decimals, points that fall on the
+same quantized location are merged (their weights summed) with one integer
+key per location, and the weights are normalized to 0-1 so that a single
+very large pincode does not push every other point to the bottom of the
+gradient. The result is a compact payload of integer arrays that
+`map_layers.CachedHeatMap` expands in the browser.
+
+Run this module to benchmark it against the former list-of-rows build.
+"""
+
+import numpy as np
+import pandas as pd
+
+WEIGHTINGS = ['linear', 'log', 'percentile']
+
+# Normalized weights are sent as integers in 1/WEIGHT_SCALE steps
+WEIGHT_SCALE = 1000
+
+
+def normalize_weights(weights, weighting='linear'):
+    """
+    Weights scaled to (0, 1]: proportional to the weight ('linear'), to its
+    logarithm ('log') or its percentile rank among the weights ('percentile').
+    """
+    weights = np.asarray(weights, dtype=float)
+    if len(weights) == 0:
+        return weights
+    if weighting == 'linear':
+        return weights / weights.max()
+    if weighting == 'log':
+        return np.log1p(weights) / np.log1p(weights.max())
+    if weighting == 'percentile':
+        return np.searchsorted(np.sort(weights), weights, side='right') / len(weights)
+    raise ValueError(f"Unknown weighting {weighting!r}, expected one of {WEIGHTINGS}")
+
+
+def heat_points(latitudes, longitudes, weights=None, precision=4, weighting='linear'):
+    """
+    Heatmap payload of weighted points (weight 1 each without `weights`).
+
+    Points without coordinates or with no positive weight are left out.
+    Returns a dict with the integer arrays `lat` and `lon` (degrees times
+    `scale`) and `weight` (normalized weight times `weight_scale`).
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    weights = np.ones(len(latitudes)) if weights is None else np.asarray(weights, dtype=float)
+    keep = np.isfinite(latitudes) & np.isfinite(longitudes) & (weights > 0)
+    latitudes, longitudes, weights = latitudes[keep], longitudes[keep], weights[keep]
+
+    scale = 10 ** precision
+    lat = np.round(latitudes * scale).astype(np.int64)
+    lon = np.round(longitudes * scale).astype(np.int64)
+
+    # One integer key per quantized location; factorize hashes instead of sorting
+    lon_min = lon.min() if len(lon) else 0
+    lon_span = lon.max() - lon_min + 1 if len(lon) else 1
+    labels, keys = pd.factorize(lat * lon_span + (lon - lon_min))
+    merged = np.bincount(labels, weights=weights, minlength=len(keys))
+
+    # Every remaining point keeps at least the smallest visible weight
+    levels = np.maximum(np.round(normalize_weights(merged, weighting) * WEIGHT_SCALE), 1).astype(np.int64)
+    return {
+        'scale': scale,
+        'weight_scale': WEIGHT_SCALE,
+        'lat': keys // lon_span,
+        'lon': keys % lon_span + lon_min,
+        'weight': levels,
+    }
+
+
+def _benchmark(sizes=(10_000, 100_000, 1_000_000), legacy_limit=100_000):
+    """Print build time and payload of the former iterrows build and of heat_points at each size"""
+    import json
+    import time
+
+    import folium
+    from folium.plugins import HeatMap
+
+    from map_layers import CachedHeatMap
+
+    rng = np.random.default_rng(0)
+    print(f"{'points':>10} {'locations':>10}  {'build':<22} {'seconds':>8} {'payload MB':>11}")
+    for size in sizes:
+        # Address-like points on a few thousand pincodes with heavy-tailed counts, and all-distinct points
+        for n_locations in (max(size // 50, 1), size):
+            locations = rng.uniform([8, 68], [35, 97], size=(n_locations, 2))
+            picks = rng.integers(0, n_locations, size) if n_locations < size else np.arange(size)
+            frame = pd.DataFrame({
+                'Latitude': locations[picks, 0],
+                'Longitude': locations[picks, 1],
+                'count': rng.pareto(1.2, size).astype(int) + 1,
+            })
+
+            if size <= legacy_limit:
+                start = time.perf_counter()
+                heat_data = [[row['Latitude'], row['Longitude'], row['count']] for _, row in frame.iterrows()]
+                layer = HeatMap(heat_data).add_to(folium.Map())
+                seconds = time.perf_counter() - start
+                payload = len(json.dumps(layer.data)) / 2**20
+                print(f"{size:>10,} {n_locations:>10,}  {'rows (iterrows)':<22} {seconds:>8.3f} {payload:>11.2f}")
+
+            for weighting in WEIGHTINGS:
+                start = time.perf_counter()
+                points = heat_points(frame['Latitude'], frame['Longitude'], frame['count'], weighting=weighting)
+                layer = CachedHeatMap(points).add_to(folium.Map())
+                seconds = time.perf_counter() - start
+                payload = len(layer.points) / 2**20
+                print(f"{size:>10,} {n_locations:>10,}  {'heat_points ' + weighting:<22} {seconds:>8.3f} {payload:>11.2f}")
+
+
+if __name__ == '__main__':
+    _benchmark()
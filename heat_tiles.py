@@ -0,0 +1,177 @@
+"""
+Pre-rendered heatmap tiles.
+
+The HeatMap plugin ships every weighted point to the browser and blurs them
+on a canvas on every pan and zoom. Here the same picture is rasterized once on
+the server: for every zoom level the points are binned into the Web Mercator
+pixels of each 256 px tile (plus a margin of one kernel radius), smoothed
+with a Gaussian kernel as two small matrix products, coloured with the heatmap
+gradient and written as XYZ PNG tiles that a plain TileLayer loads.
+
+Tile sets are stored under static/heat_tiles/<version>/{z}/{x}/{y}.png, where
+the version hashes the points, weights and rendering settings, so a tile set
+is rendered once per dataset and filter combination and then served as static
+files by Streamlit (server.enableStaticServing).
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageColor
+
+from pincode_clusters import TILE_SIZE, world_pixels
+
+# Rendering version: bump when the tile images change for the same input
+TILES_VERSION = 1
+
+# Served by Streamlit from the static/ folder next to the dashboards
+TILE_DIR = Path(__file__).with_name('static') / 'heat_tiles'
+TILE_URL = '/app/static/heat_tiles'
+
+# Same colour stops as the HeatMap layers in the dashboards
+DEFAULT_GRADIENT = {0.0: 'blue', 0.5: 'lime', 0.7: 'yellow', 1.0: 'red'}
+
+# Tiles are palette images: intensity level i is palette colour i with alpha i, so the
+# heat fades out with its intensity like the canvas heatmap
+ALPHA_LEVELS = bytes(range(256))
+PNG_COMPRESS_LEVEL = 3
+
+# Most recently used tile sets kept on disk
+MAX_TILE_SETS = 20
+
+
+def tile_set_version(latitudes, longitudes, weights, min_zoom, max_zoom, radius, gradient):
+    """Short hash identifying the tiles rendered from these points and settings"""
+    digest = hashlib.sha1(f"v{TILES_VERSION}:{min_zoom}:{max_zoom}:{radius}:{sorted(gradient.items())}".encode('utf-8'))
+    for values in (latitudes, longitudes, weights):
+        digest.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _gradient_palette(gradient):
+    """PNG palette of 256 RGB colours interpolated between the gradient stops"""
+    stops = sorted(gradient.items())
+    positions = [position for position, _ in stops]
+    colors = np.array([ImageColor.getrgb(color)[:3] for _, color in stops], dtype=float)
+    levels = np.linspace(0, 1, 256)
+    lookup = np.stack([np.interp(levels, positions, colors[:, channel]) for channel in range(3)], axis=1)
+    return lookup.round().astype(np.uint8).tobytes()
+
+
+def _kernel_matrix(radius):
+    """
+    TILE_SIZE x (TILE_SIZE + 2 * radius) Gaussian smoothing matrix: row i weights
+    the padded pixels within `radius` of tile pixel i (sigma is a third of the radius).
+    """
+    offsets = np.arange(TILE_SIZE + 2 * radius)[None, :] - radius - np.arange(TILE_SIZE)[:, None]
+    kernel = np.exp(-0.5 * (offsets / (radius / 3)) ** 2)
+    kernel[np.abs(offsets) > radius] = 0
+    return kernel
+
+
+def _render_zoom(x, y, weights, zoom, radius, kernel, palette, out_dir):
+    """Write the non-empty tiles of one zoom level, return how many were written"""
+    n_tiles = 2 ** zoom
+    px = np.floor(x * n_tiles).astype(np.int64)
+    py = np.floor(y * n_tiles).astype(np.int64)
+
+    # Every tile whose padded area holds a point: at most 2 x 2 tiles per point
+    points = np.arange(len(px))
+    tile_xs = [(px - radius) // TILE_SIZE, (px + radius) // TILE_SIZE]
+    tile_ys = [(py - radius) // TILE_SIZE, (py + radius) // TILE_SIZE]
+    candidates = []
+    for tile_x in tile_xs:
+        for tile_y in tile_ys:
+            on_map = (tile_x >= 0) & (tile_x < n_tiles) & (tile_y >= 0) & (tile_y < n_tiles)
+            candidates.append(np.stack([(tile_x * n_tiles + tile_y)[on_map], points[on_map]], axis=1))
+    # (tile, point) pairs sorted by tile
+    pairs = np.unique(np.concatenate(candidates), axis=0)
+    if len(pairs) == 0:
+        return 0
+
+    # Colour scale of the level: a single point of the heaviest pixel is the top of the gradient
+    _, pixel_labels = np.unique(px * (n_tiles * TILE_SIZE) + py, return_inverse=True)
+    scale = np.log1p(np.bincount(pixel_labels.reshape(-1), weights=weights).max())
+
+    padded = TILE_SIZE + 2 * radius
+    tiles, starts = np.unique(pairs[:, 0], return_index=True)
+    written = 0
+    for tile, start, stop in zip(tiles, starts, np.append(starts[1:], len(pairs))):
+        tile_points = pairs[start:stop, 1]
+        tx, ty = divmod(int(tile), n_tiles)
+        local_x = px[tile_points] - tx * TILE_SIZE + radius
+        local_y = py[tile_points] - ty * TILE_SIZE + radius
+        counts = np.bincount(local_y * padded + local_x, weights=weights[tile_points],
+                             minlength=padded * padded).reshape(padded, padded)
+
+        density = kernel @ counts @ kernel.T
+        intensity = np.clip(np.log1p(density) / scale, 0, 1) if scale > 0 else np.zeros_like(density)
+        levels = np.round(intensity * 255).astype(np.uint8)
+        if not levels.any():
+            continue
+
+        tile_path = out_dir / str(zoom) / str(tx) / f"{ty}.png"
+        tile_path.parent.mkdir(parents=True, exist_ok=True)
+        image = Image.fromarray(levels, 'L').convert('P')
+        image.putpalette(palette)
+        image.save(tile_path, transparency=ALPHA_LEVELS, compress_level=PNG_COMPRESS_LEVEL)
+        written += 1
+    return written
+
+
+def render_heat_tiles(latitudes, longitudes, weights, min_zoom, max_zoom, radius=25,
+                      gradient=DEFAULT_GRADIENT, tile_dir=TILE_DIR):
+    """
+    Render the heatmap tiles of weighted points for zoom levels `min_zoom` to
+    `max_zoom` (unless they already exist) and return the tile set version,
+    or None when the tiles could not be written.
+
+    `radius` is the kernel radius in screen pixels, the same at every zoom.
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    version = tile_set_version(latitudes, longitudes, weights, min_zoom, max_zoom, radius, gradient)
+    out_dir = Path(tile_dir) / version
+
+    if out_dir.exists():
+        os.utime(out_dir)  # Mark as recently used for pruning
+        return version
+
+    # Render into a private folder and move it into place, so a half-written set is never served
+    tmp_dir = Path(tile_dir) / f".{version}-{uuid.uuid4().hex}.tmp"
+    x, y = world_pixels(latitudes, longitudes)
+    kernel = _kernel_matrix(radius)
+    palette = _gradient_palette(gradient)
+    try:
+        tmp_dir.mkdir(parents=True)
+        for zoom in range(min_zoom, max_zoom + 1):
+            _render_zoom(x, y, weights, zoom, radius, kernel, palette, tmp_dir)
+        os.replace(tmp_dir, out_dir)
+    except OSError as e:
+        # Another session finished the same set first, or the disk is not writable
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if out_dir.exists():
+            return version
+        print(f"⚠️  Could not write heatmap tiles {out_dir}: {e}")
+        return None
+
+    _prune_tile_sets(tile_dir)
+    return version
+
+
+def _prune_tile_sets(tile_dir, keep=MAX_TILE_SETS):
+    """Remove all but the `keep` most recently used tile sets"""
+    tile_sets = [path for path in Path(tile_dir).iterdir() if path.is_dir() and not path.name.startswith('.')]
+    tile_sets.sort(key=lambda path: path.stat().st_mtime_ns, reverse=True)
+    for stale in tile_sets[keep:]:
+        shutil.rmtree(stale, ignore_errors=True)
+
+
+def tile_url(version):
+    """XYZ URL template of a rendered tile set"""
+    return f"{TILE_URL}/{version}/{{z}}/{{x}}/{{y}}.png"
@@ -0,0 +1,100 @@
+"""
+Hexagonal binning of weighted pincode locations.
+
+Locations are projected to Web Mercator (so the hexagons look regular on the
+map) and assigned to pointy-top hexagons in axial (q, r) coordinates: the
+fractional axial position of every point is rounded to its hexagon with the
+usual cube-coordinate rounding, all in vectorized NumPy. Weights per hexagon
+are a single bincount over the hexagon labels, so re-binning for another
+filter or cell size costs milliseconds.
+"""
+
+import numpy as np
+import pandas as pd
+
+from pincode_clusters import MAX_LATITUDE, TILE_SIZE, world_pixels
+
+# Equatorial circumference of the Web Mercator sphere
+EARTH_CIRCUMFERENCE_KM = 40075.016686
+
+SQRT3 = np.sqrt(3)
+
+# Corner directions of a pointy-top hexagon (first corner repeated to close the ring)
+CORNER_ANGLES = np.radians(30 + 60 * np.arange(7))
+
+
+def _hex_radius(cell_km, reference_latitude):
+    """Hexagon circumradius in zoom-0 world pixels for cells `cell_km` across the flats at the reference latitude"""
+    km_per_pixel = EARTH_CIRCUMFERENCE_KM * np.cos(np.radians(reference_latitude)) / TILE_SIZE
+    return cell_km / km_per_pixel / SQRT3
+
+
+def _world_to_latlon(x, y):
+    """Inverse of `world_pixels`"""
+    longitudes = x / TILE_SIZE * 360 - 180
+    latitudes = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / TILE_SIZE))))
+    return latitudes, longitudes
+
+
+def axial_coordinates(x, y, radius):
+    """Axial (q, r) of the pointy-top hexagon of radius `radius` containing each point"""
+    q = (SQRT3 / 3 * x - y / 3) / radius
+    r = (2 / 3 * y) / radius
+    s = -q - r
+
+    # Round in cube coordinates and fix the component with the largest rounding error
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_bins(latitudes, longitudes, weights, cell_km, reference_latitude=0.0, total=None):
+    """
+    Weighted hexagon bins of points, one row per non-empty hexagon.
+
+    Hexagons are `cell_km` across at `reference_latitude` (Web Mercator
+    stretches them towards the poles). Percentages are relative to `total`,
+    which defaults to the sum of `weights`.
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    total = weights.sum() if total is None else total
+    radius = _hex_radius(cell_km, reference_latitude)
+
+    x, y = world_pixels(latitudes, longitudes)
+    q, r = axial_coordinates(x, y, radius)
+    # One integer key per hexagon, so grouping is a 1-D unique
+    r_min = r.min() if len(r) else 0
+    r_span = r.max() - r_min + 1 if len(r) else 1
+    keys, labels = np.unique(q * r_span + (r - r_min), return_inverse=True)
+    labels = labels.reshape(-1)
+    cell_q, cell_r = keys // r_span, keys % r_span + r_min
+    counts = np.bincount(labels, weights=weights, minlength=len(keys))
+
+    center_x = radius * SQRT3 * (cell_q + cell_r / 2)
+    center_y = radius * 1.5 * cell_r
+    center_lat, center_lon = _world_to_latlon(center_x, center_y)
+
+    return pd.DataFrame({
+        'q': cell_q,
+        'r': cell_r,
+        'Latitude': center_lat,
+        'Longitude': center_lon,
+        'count': counts.round().astype(np.int64),
+        'percentage': counts / total * 100 if total else np.zeros(len(keys)),
+        'n_points': np.bincount(labels, minlength=len(keys)),
+    })
+
+
+def hex_rings(bins, cell_km, reference_latitude=0.0):
+    """(n, 7, 2) closed [longitude, latitude] corner rings of the hexagons in `bins` (from `hex_bins`)"""
+    radius = _hex_radius(cell_km, reference_latitude)
+    q, r = bins['q'].to_numpy()[:, None], bins['r'].to_numpy()[:, None]
+    x = radius * SQRT3 * (q + r / 2) + radius * np.cos(CORNER_ANGLES)
+    y = radius * 1.5 * r + radius * np.sin(CORNER_ANGLES)
+    latitudes, longitudes = _world_to_latlon(x, y)
+    return np.stack([longitudes, np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE)], axis=2)
@@ -0,0 +1,205 @@
+"""
+Cache of rendered map layers, keyed by the dashboard filter state.
+
+For a given combination of filters (plus the zoom level and, in viewport
+mode, the visible area) the layers sent to the map are always the same, so
+their serialized scripts are kept in a size-bounded LRU that every session of
+the server process shares: repeated views, and every user opening the default
+view, skip building the markers, clusters and heatmap altogether.
+
+Keys hash the normalized filter values together with the signature of the
+source files and of every local module the dashboard has loaded (see
+snapshot_cache.py), so new data or edited layer code never serves old layers. Entries pushed out of memory can optionally spill to
+a directory, which is size-bounded as well and survives restarts.
+
+MarkerBudget sizes the marker layers from the timings of those builds.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+
+from snapshot_cache import source_signature
+
+# Format version of the cache entries: bump when the serialized layer format changes
+MAP_CACHE_VERSION = 1
+
+
+def layer_modules():
+    """
+    Source files of the loaded modules that live next to the dashboards: the
+    code that shapes the rendered layers, found when the cache is created so
+    that new layer modules are covered without listing them anywhere.
+    """
+    here = Path(__file__).resolve().parent
+    files = {Path(module.__file__).resolve() for module in list(sys.modules.values())
+             if getattr(module, '__file__', None) and module.__file__.endswith('.py')}
+    return sorted(path for path in files if path.parent == here)
+
+
+def _normalize(value):
+    """JSON-ready form of a filter value in which equal filter states compare equal"""
+    if isinstance(value, (set, frozenset)):
+        return sorted((_normalize(item) for item in value), key=repr)
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, dict):
+        return {str(name): _normalize(item) for name, item in value.items()}
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        # Slider steps such as 4.1 or 4.000000001 should not give different keys
+        return round(value, 6)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, int, str)):
+        return value
+    return str(value)
+
+
+class RenderedMapCache:
+    """
+    Least recently used map layers, at most `max_bytes` in memory.
+
+    `sources` are the data files and dashboard script the layers are built
+    from; their signature, with that of the `layer_modules()` loaded by then,
+    is part of every key. Create the cache after the dashboard's imports.
+
+    With `spill_dir`, entries evicted from memory are written there (at most
+    `max_spill_bytes`, oldest used removed first) and read back on a miss.
+    """
+
+    def __init__(self, sources, max_bytes=32 * 2**20, spill_dir=None, max_spill_bytes=256 * 2**20):
+        # Optional sources that are missing (e.g. no hospital list) are left out of the signature
+        sources = [path for path in [*sources, *layer_modules()] if os.path.exists(path)]
+        self.signature = source_signature(sources, MAP_CACHE_VERSION)
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self.max_spill_bytes = max_spill_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def key(self, **filters):
+        """Cache key of a filter state"""
+        state = json.dumps([self.signature, _normalize(filters)], sort_keys=True, separators=(',', ':'))
+        return hashlib.sha1(state.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Cached value for `key`, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[0]
+
+        value = self._read_spilled(key)
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Store the string `value`, evicting the least recently used entries beyond `max_bytes`"""
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        evicted = []
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                old_key, (old_value, old_size) = self._entries.popitem(last=False)
+                self._size -= old_size
+                evicted.append((old_key, old_value))
+
+        # Disk writes happen outside the lock so other sessions are not held up
+        for old_key, old_value in evicted:
+            self._spill(old_key, old_value)
+
+    def _spill_path(self, key):
+        return self.spill_dir / f"{key}.json"
+
+    def _read_spilled(self, key):
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(key)
+        try:
+            value = path.read_text(encoding='utf-8')
+            os.utime(path)  # Mark as recently used for the disk eviction order
+        except OSError:
+            return None
+        return value
+
+    def _spill(self, key, value):
+        if self.spill_dir is None:
+            return
+        path = self._spill_path(key)
+        try:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            if not path.exists():
+                tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+                tmp_path.write_text(value, encoding='utf-8')
+                os.replace(tmp_path, path)
+            self._trim_spill_dir()
+        except OSError as e:
+            # Spilling is an optimisation only - the entry is simply rebuilt when needed again
+            print(f"⚠️  Could not spill map cache entry {path}: {e}")
+
+    def _trim_spill_dir(self):
+        """Remove the least recently used spilled entries beyond `max_spill_bytes`"""
+        files = []
+        for path in self.spill_dir.glob('*.json'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime_ns, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_spill_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+class MarkerBudget:
+    """
+    Number of markers a map build can afford within `seconds`.
+
+    The server time per marker is learnt from the timings of previous builds
+    (a moving average starting at `seconds_per_marker`); creating each marker
+    in the browser adds the fixed estimate `browser_seconds_per_marker`.
+    """
+
+    def __init__(self, seconds, seconds_per_marker=20e-6, browser_seconds_per_marker=200e-6, smoothing=0.3):
+        self.seconds = seconds
+        self.seconds_per_marker = seconds_per_marker
+        self.browser_seconds_per_marker = browser_seconds_per_marker
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def record(self, n_markers, seconds):
+        """Account for a build of `n_markers` markers that took `seconds`"""
+        if n_markers <= 0:
+            return
+        with self._lock:
+            self.seconds_per_marker += self.smoothing * (seconds / n_markers - self.seconds_per_marker)
+
+    def max_markers(self, steps):
+        """
+        Largest of the ascending `steps` whose markers fit the budget (the
+        first step if none does); rounding down to a step keeps the cache keys
+        of the layers stable while the estimate moves.
+        """
+        affordable = self.seconds / (self.seconds_per_marker + self.browser_seconds_per_marker)
+        fitting = [step for step in steps if step <= affordable]
+        return fitting[-1] if fitting else steps[0]
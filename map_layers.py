@@ -0,0 +1,464 @@
+"""
+Map layers shared by the address and surgery dashboards.
+
+Pincode markers are shipped to the browser as one GeoJSON FeatureCollection
+whose properties (count, percentage, city, colour, ...) are built from the
+summary columns with NumPy. The marker icon, tooltip and popup are rendered
+client-side from one template string each, with `{property}` placeholders
+filled in per feature, instead of serializing a separate Marker, DivIcon,
+Popup and Tooltip object for every pincode.
+
+Finished overlays can be serialized to JSON and rebuilt later without
+re-running any of that (see map_cache.py).
+"""
+
+import hashlib
+import json
+
+import numpy as np
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.map import FeatureGroup, Layer
+from folium.plugins import HeatMap, MarkerCluster
+from jinja2 import Template
+
+# Decimal places kept in the GeoJSON payload (5 decimals is ~1 m)
+COORD_DECIMALS = 5
+VALUE_DECIMALS = 4
+
+# Marker colour bands, from the highest band down
+BAND_COLORS = ['red', 'orange', 'lightgreen']
+DEFAULT_COLOR = 'lightblue'
+
+
+def band_colors(values, limits, inclusive=True):
+    """Colour per value: the first of BAND_COLORS whose limit it reaches, else DEFAULT_COLOR"""
+    values = np.asarray(values)
+    limits = np.asarray(limits)[:, None]
+    reached = values >= limits if inclusive else values > limits
+    return np.select(list(reached), BAND_COLORS[:len(limits)], DEFAULT_COLOR)
+
+
+def format_percentages(percentages):
+    """Percentages as display strings ("<1%" below one percent, one decimal otherwise)"""
+    percentages = np.asarray(percentages, dtype=float)
+    return np.where(percentages < 1, '<1%', np.char.mod('%.1f%%', percentages))
+
+
+def cluster_icon_properties(counts, percentages, percentage_mode):
+    """Label, colour and size class of cluster bubbles (same bands as the old MarkerCluster icons)"""
+    counts = np.asarray(counts)
+    percentages = np.asarray(percentages, dtype=float)
+    if percentage_mode:
+        labels = format_percentages(percentages)
+        colors = band_colors(percentages, (10, 5, 1))
+        sizes = np.select([percentages >= 10, percentages >= 5], ['large', 'medium'], 'small')
+    else:
+        labels = counts.astype(str)
+        # Counts are integers, so "> 99" is the ">= 100" band of the cluster icons
+        colors = band_colors(counts, (1000, 500, 99), inclusive=False)
+        sizes = np.select([counts >= 5000, counts >= 1000], ['large', 'medium'], 'small')
+    return labels, colors, sizes
+
+
+def viewport_bounds(map_state, margin=0.25):
+    """
+    (south, west, north, east) of the map view returned by st_folium, widened
+    by `margin` times its height and width on every side so that short pans
+    stay covered. None until the map has reported its bounds.
+    """
+    bounds = (map_state or {}).get('bounds') or {}
+    south_west, north_east = bounds.get('_southWest') or {}, bounds.get('_northEast') or {}
+    corners = [south_west.get('lat'), south_west.get('lng'), north_east.get('lat'), north_east.get('lng')]
+    if any(corner is None for corner in corners):
+        return None
+    south, west, north, east = corners
+    lat_margin = (north - south) * margin
+    lon_margin = (east - west) * margin
+    return south - lat_margin, west - lon_margin, north + lat_margin, east + lon_margin
+
+
+def format_coordinates(latitudes, longitudes):
+    """"lat, lon" display strings with four decimals"""
+    return np.char.add(np.char.add(np.char.mod('%.4f', np.asarray(latitudes, dtype=float)), ', '),
+                       np.char.mod('%.4f', np.asarray(longitudes, dtype=float)))
+
+
+def _json_column(values):
+    """Plain Python values for one property column (floats rounded, missing floats as null)"""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        rounded = np.round(values.astype(float), VALUE_DECIMALS)
+        return [None if value != value else value for value in rounded.tolist()]
+    if values.dtype.kind in 'iub':
+        return values.tolist()
+    return [str(value) for value in values.tolist()]
+
+
+def feature_collection(latitudes, longitudes, properties):
+    """GeoJSON FeatureCollection of points with one property per `{name: column}` entry"""
+    lats = np.round(np.asarray(latitudes, dtype=float), COORD_DECIMALS).tolist()
+    lons = np.round(np.asarray(longitudes, dtype=float), COORD_DECIMALS).tolist()
+    names = list(properties)
+    columns = [_json_column(properties[name]) for name in names]
+
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': dict(zip(names, row)),
+        }
+        for lat, lon, *row in zip(lats, lons, *columns)
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def polygon_collection(rings, properties):
+    """GeoJSON FeatureCollection of single-ring polygons ((n, corners, 2) [lon, lat] array) with properties"""
+    rings = np.round(np.asarray(rings, dtype=float), COORD_DECIMALS).tolist()
+    names = list(properties)
+    columns = [_json_column(properties[name]) for name in names]
+
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+            'properties': dict(zip(names, row)),
+        }
+        for ring, *row in zip(rings, *columns)
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def multipolygon_collection(geometries, properties):
+    """GeoJSON FeatureCollection of MultiPolygons (coordinate lists, e.g. pincode boundaries) with properties"""
+    names = list(properties)
+    columns = [_json_column(properties[name]) for name in names]
+
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'MultiPolygon', 'coordinates': geometry},
+            'properties': dict(zip(names, row)),
+        }
+        for geometry, *row in zip(geometries, *columns)
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def _script_json(data):
+    """Compact JSON that is safe to embed in a <script> block"""
+    text = json.dumps(data, separators=(',', ':'))
+    return text.replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+
+
+def _content_key(*parts):
+    """Short hash identifying a layer by its serialized content"""
+    return hashlib.sha1('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:16]
+
+
+class FeatureMarkerLayer(Layer):
+    """
+    Markers for a GeoJSON FeatureCollection of points.
+
+    `icon_template`, `tooltip_template` and `popup_template` are HTML strings
+    with `{property}` placeholders, as is the `icon_class` CSS class name.
+    With `circle_options`, CircleMarkers are drawn instead of DivIcons; string
+    option values are templates too (e.g. `{'color': '{color}'}`), as they are
+    in `style_options`, the path style of non-point features.
+    `marker_options` maps Leaflet marker option names to feature properties,
+    e.g. so that a MarkerCluster `icon_create_function` can read
+    `options.customCount` from the children. With `zoom_to_bounds`, clicking
+    a marker fits the map to its south/west/north/east properties.
+
+    Tooltips and popups are filled in when they open. With `lookup_url` (see
+    static_lookups.py), the properties of the table row for the feature's
+    `lookup_key` property are available to them as well, so features only
+    need to carry the values that change with the filters.
+
+    The built Leaflet layer is kept in the browser's dynamic layer cache (see
+    DynamicLayerAssets) under a hash of its content, so re-sending an
+    unchanged layer re-attaches it instead of rebuilding every marker.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = window.dynamicLayerCache && window.dynamicLayerCache.get({{ this.cache_key|tojson }});
+            if (!{{ this.get_name() }}) {
+                var {{ this.get_name() }}_fill = function(template, props) {
+                    return template.replace(/\{(\w+)\}/g, function(match, key) {
+                        return key in props ? props[key] : match;
+                    });
+                };
+                var {{ this.get_name() }}_options = function(templates, props) {
+                    var options = {};
+                    for (var name in templates) {
+                        var value = templates[name];
+                        options[name] = typeof value === 'string' ? {{ this.get_name() }}_fill(value, props) : value;
+                    }
+                    return options;
+                };
+                {%- if this.lookup_url %}
+                // Shared by every layer using the table: fetched once, decoded one row at a time
+                window.featureLookups = window.featureLookups || {};
+                var {{ this.get_name() }}_lookup = window.featureLookups[{{ this.lookup_url|tojson }}];
+                if (!{{ this.get_name() }}_lookup) {
+                    {{ this.get_name() }}_lookup = window.featureLookups[{{ this.lookup_url|tojson }}] = {table: null};
+                    {{ this.get_name() }}_lookup.ready = fetch({{ this.lookup_url|tojson }}).then(function(response) {
+                        return response.json();
+                    }).then(function(table) {
+                        {{ this.get_name() }}_lookup.table = table;
+                    });
+                }
+                {%- endif %}
+                var {{ this.get_name() }}_details = function(props) {
+                    {%- if this.lookup_url %}
+                    var table = {{ this.get_name() }}_lookup.table, row = table && table.rows[props[{{ this.lookup_key|tojson }}]];
+                    if (row) {
+                        var details = {};
+                        table.fields.forEach(function(field, i) {
+                            details[field] = table.labels[i] ? table.labels[i][row[i]] : row[i];
+                        });
+                        return Object.assign(details, props);
+                    }
+                    {%- endif %}
+                    return props;
+                };
+                {{ this.get_name() }} = L.geoJson(null, {
+                    {%- if this.style_options %}
+                    style: function(feature) {
+                        return {{ this.get_name() }}_options({{ this.style_options }}, feature.properties);
+                    },
+                    {%- endif %}
+                    pointToLayer: function(feature, latlng) {
+                        var props = feature.properties;
+                        {%- if this.circle_options %}
+                        var marker = L.circleMarker(latlng, {{ this.get_name() }}_options({{ this.circle_options }}, props));
+                        {%- else %}
+                        var marker = L.marker(latlng, {
+                            icon: L.divIcon({
+                                html: {{ this.get_name() }}_fill({{ this.icon_template }}, props),
+                                {%- if this.icon_size %}
+                                iconSize: {{ this.icon_size }},
+                                {%- endif %}
+                                className: {{ this.get_name() }}_fill({{ this.icon_class }}, props)
+                            })
+                        });
+                        {%- endif %}
+                        var optionProperties = {{ this.marker_options }};
+                        for (var option in optionProperties) {
+                            marker.options[option] = props[optionProperties[option]];
+                        }
+                        return marker;
+                    },
+                    onEachFeature: function(feature, layer) {
+                        {%- if this.tooltip_template %}
+                        layer.bindTooltip(function() {
+                            return {{ this.get_name() }}_fill({{ this.tooltip_template }}, {{ this.get_name() }}_details(feature.properties));
+                        }, {sticky: true});
+                        {%- endif %}
+                        {%- if this.popup_template %}
+                        layer.bindPopup(function() {
+                            return {{ this.get_name() }}_fill({{ this.popup_template }}, {{ this.get_name() }}_details(feature.properties));
+                        }, {maxWidth: {{ this.popup_max_width }}});
+                        {%- endif %}
+                        {%- if this.lookup_url %}
+                        // Opened before the table arrived: fill in again once it has
+                        layer.on('tooltipopen popupopen', function(e) {
+                            var overlay = e.tooltip || e.popup;
+                            if (!{{ this.get_name() }}_lookup.table) {
+                                {{ this.get_name() }}_lookup.ready.then(function() { overlay.update(); });
+                            }
+                        });
+                        {%- endif %}
+                        {%- if this.zoom_to_bounds %}
+                        layer.on('click', function(e) {
+                            var props = feature.properties;
+                            e.target._map.fitBounds([[props.south, props.west], [props.north, props.east]], {padding: [40, 40]});
+                        });
+                        {%- endif %}
+                    }
+                });
+                {{ this.get_name() }}.addData({{ this.data }});
+                if (window.dynamicLayerCache) {
+                    window.dynamicLayerCache.put({{ this.cache_key|tojson }}, {{ this.get_name() }});
+                }
+            }
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, data, icon_template=None, tooltip_template=None, popup_template=None,
+                 marker_options=None, popup_max_width=250, icon_class='empty', icon_size=None,
+                 circle_options=None, style_options=None, zoom_to_bounds=False, lookup_url=None,
+                 lookup_key=None, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = 'FeatureMarkerLayer'
+        self.data = _script_json(data)
+        self.icon_template = _script_json(icon_template or '')
+        self.tooltip_template = _script_json(tooltip_template) if tooltip_template else None
+        self.popup_template = _script_json(popup_template) if popup_template else None
+        self.marker_options = _script_json(marker_options or {})
+        self.popup_max_width = popup_max_width
+        self.icon_class = _script_json(icon_class)
+        self.icon_size = _script_json(list(icon_size)) if icon_size else None
+        self.circle_options = _script_json(circle_options) if circle_options else None
+        self.style_options = _script_json(style_options) if style_options else None
+        self.zoom_to_bounds = zoom_to_bounds
+        self.lookup_url = lookup_url
+        self.lookup_key = lookup_key
+        self.cache_key = _content_key(
+            type(self).__name__, self.data, self.icon_template, self.tooltip_template, self.popup_template,
+            self.marker_options, popup_max_width, self.icon_class, self.icon_size, self.circle_options,
+            self.style_options, zoom_to_bounds, lookup_url, lookup_key
+        )
+
+
+class FeaturePolygonLayer(FeatureMarkerLayer):
+    """Polygons of a GeoJSON FeatureCollection, styled per feature from templated `style_options`"""
+
+    def __init__(self, data, style_options, tooltip_template=None, popup_template=None, popup_max_width=250,
+                 lookup_url=None, lookup_key=None, name=None, overlay=True, control=True, show=True):
+        super().__init__(data, tooltip_template=tooltip_template, popup_template=popup_template,
+                         popup_max_width=popup_max_width, style_options=style_options, lookup_url=lookup_url,
+                         lookup_key=lookup_key, name=name, overlay=overlay, control=control, show=show)
+        self._name = 'FeaturePolygonLayer'
+
+
+class ClusterMarkerLayer(JSCSSMixin, FeatureMarkerLayer):
+    """FeatureMarkerLayer for precomputed cluster bubbles, styled with the Leaflet.markercluster CSS"""
+
+    default_css = MarkerCluster.default_css
+
+
+class CachedHeatMap(HeatMap):
+    """
+    HeatMap of a `heat_layer.heat_points` payload, kept in the browser's
+    dynamic layer cache like FeatureMarkerLayer. The integer coordinates and
+    weights of the payload are expanded to [lat, lng, weight] in the browser.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = window.dynamicLayerCache && window.dynamicLayerCache.get({{ this.cache_key|tojson }});
+            if (!{{ this.get_name() }}) {
+                var points = {{ this.points }};
+                var latlngs = new Array(points.lat.length);
+                for (var i = 0; i < latlngs.length; i++) {
+                    latlngs[i] = [points.lat[i] / points.scale, points.lon[i] / points.scale,
+                                  points.weight[i] / points.weight_scale];
+                }
+                {{ this.get_name() }} = L.heatLayer(latlngs, {{ this.options|tojson }});
+                if (window.dynamicLayerCache) {
+                    window.dynamicLayerCache.put({{ this.cache_key|tojson }}, {{ this.get_name() }});
+                }
+            }
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+
+    def __init__(self, points, **kwargs):
+        # The points are already validated, so skip the per-point checks of HeatMap
+        super().__init__([], **kwargs)
+        self.points = _script_json({name: np.asarray(values).tolist() for name, values in points.items()})
+        self.cache_key = _content_key(type(self).__name__, self.points, json.dumps(self.options, sort_keys=True))
+
+
+class DynamicLayerAssets(JSCSSMixin, MacroElement):
+    """
+    Loads the stylesheets and scripts of the dynamic layers with the base map.
+
+    streamlit-folium only loads CSS and JS links when the map is first
+    mounted, so layers that are pushed later through `feature_group_to_add`
+    (cluster bubbles, heatmap) need their assets attached to the base map.
+
+    It also sets up the browser-side layer cache. streamlit-folium removes
+    and re-evaluates every dynamic layer whenever one of them changes; with
+    the cache, only the layers whose content changed are rebuilt and the
+    others are re-attached as they are. The `max_layers` most recently used
+    layers are kept.
+    """
+
+    default_css = MarkerCluster.default_css
+    default_js = HeatMap.default_js
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            window.dynamicLayerCache = window.dynamicLayerCache || (function() {
+                var layers = {}, order = [];
+                function touch(key) {
+                    var position = order.indexOf(key);
+                    if (position >= 0) {
+                        order.splice(position, 1);
+                    }
+                    order.push(key);
+                }
+                return {
+                    get: function(key) {
+                        if (layers[key]) {
+                            touch(key);
+                        }
+                        return layers[key];
+                    },
+                    put: function(key, layer) {
+                        layers[key] = layer;
+                        touch(key);
+                        while (order.length > {{ this.max_layers }}) {
+                            delete layers[order.shift()];
+                        }
+                    }
+                };
+            })();
+        {% endmacro %}
+        """)
+
+    def __init__(self, max_layers=12):
+        super().__init__()
+        self._name = 'DynamicLayerAssets'
+        self.max_layers = max_layers
+
+
+# Stands in for the parent feature group's variable in serialized layer scripts
+PARENT_PLACEHOLDER = '__PARENT_LAYER__'
+
+
+class RenderedLayer(MacroElement):
+    """Layer script rendered earlier by `serialize_overlays`, attached to a new feature group"""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            {{ this.script|replace(this.parent_placeholder, this._parent.get_name()) }}
+        {% endmacro %}
+        """)
+
+    def __init__(self, script):
+        super().__init__()
+        self._name = 'RenderedLayer'
+        self.script = script
+        self.parent_placeholder = PARENT_PLACEHOLDER
+
+
+def serialize_overlays(groups):
+    """JSON string of feature groups: their settings and the rendered script of their layers"""
+    overlays = []
+    for group in groups:
+        scripts = [child._template.module.script(child) for child in group._children.values()]
+        overlays.append({
+            'name': group.layer_name,
+            'overlay': group.overlay,
+            'control': group.control,
+            'show': group.show,
+            'script': '\n'.join(scripts).replace(group.get_name(), PARENT_PLACEHOLDER),
+        })
+    return json.dumps(overlays)
+
+
+def deserialize_overlays(text):
+    """Feature groups rebuilt from `serialize_overlays` output"""
+    groups = []
+    for overlay in json.loads(text):
+        group = FeatureGroup(name=overlay['name'], overlay=overlay['overlay'], control=overlay['control'],
+                             show=overlay['show'])
+        RenderedLayer(overlay['script']).add_to(group)
+        groups.append(group)
+    return groups
@@ -1,58 +1,261 @@
+import argparse
+import json
+import os
+import shutil
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
-def merge_address_files():
-    """Merge Address Details.csv and TNAddress.csv into a single combined CSV"""
+SOURCE_FILES = ['Address Details.csv', 'TNAddress.csv']
+OUTPUT_FILE = 'Combined_Address_Details.csv'
 
-    print("=" * 60)
-    print("Merging Address CSV Files")
-    print("=" * 60)
+# Latest record already merged from each source, used by incremental mode
+WATERMARK_FILE = 'Combined_Address_Details.watermarks.json'
+
+# Rows per chunk when streaming the extracts - peak memory depends on this, not on the file size
+CHUNK_SIZE = 100_000
+
+
+def iter_source_chunks(csv_file, usecols=None):
+    """Yield (chunk, dropped) for one address extract, with invalid pincodes dropped per chunk"""
+    for chunk in pd.read_csv(csv_file, chunksize=CHUNK_SIZE, usecols=usecols):
+        # Convert pincode to numeric
+        pincodes = pd.to_numeric(chunk['CPA_PIN_CODE'], errors='coerce')
+
+        # Drop rows with invalid pincodes
+        valid = pincodes.notna()
+        chunk = chunk[valid].assign(CPA_PIN_CODE=pincodes[valid].astype('int64'))
+        yield chunk, int((~valid).sum())
 
-    csv_files = ['Address Details.csv', 'TNAddress.csv']
-    dataframes = []
 
+def unique_pincodes(csv_file):
+    """Record count and sorted unique pincodes (int64 array) of one extract, reading only the pincode column"""
+    records = 0
+    pincodes = np.empty(0, dtype=np.int64)
+    for chunk, _ in iter_source_chunks(csv_file, usecols=['CPA_PIN_CODE']):
+        records += len(chunk)
+        pincodes = np.union1d(pincodes, chunk['CPA_PIN_CODE'].to_numpy(dtype=np.int64))
+    return records, pincodes
+
+
+def _output_columns(csv_files):
+    """Union of the source headers in first-seen order (same as concatenating the frames)"""
+    columns = []
     for csv_file in csv_files:
-        if Path(csv_file).exists():
-            print(f"\nLoading {csv_file}...")
-            df = pd.read_csv(csv_file)
+        for column in pd.read_csv(csv_file, nrows=0).columns:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def _location_keys(df):
+    """Location code per row - MR numbers are assigned in a separate series per location"""
+    if 'RRH_LOCATION_CD' in df.columns:
+        return df['RRH_LOCATION_CD'].fillna('').astype(str)
+    return pd.Series('', index=df.index)
+
+
+def _compute_watermarks(df, previous=None):
+    """
+    Watermark per location: latest registration date, the MR numbers merged on
+    that date (so rows added later the same day are still picked up) and the
+    highest MR number (for rows without a parseable date).
+    """
+    watermarks = dict(previous or {})
+    dates = pd.to_datetime(df['RegistrationDate'], format='%d/%m/%y', errors='coerce')
+    mr_numbers = pd.to_numeric(df['RRH_MR_NUM'], errors='coerce')
+
+    for location, rows in df.groupby(_location_keys(df)).groups.items():
+        location_dates = dates[rows]
+        location_mrs = mr_numbers[rows]
+
+        latest = location_dates.max()
+        seen = set(location_mrs[location_dates == latest].dropna().astype(int))
+        max_mr = location_mrs.max()
+
+        # Merge with the previous watermark so it never moves backwards
+        old = watermarks.get(location)
+        if old:
+            old_date = pd.Timestamp(old['date']) if old['date'] else pd.NaT
+            if pd.isna(latest) or (not pd.isna(old_date) and old_date > latest):
+                latest, seen = old_date, set(old['seen'])
+            elif old_date == latest:
+                seen |= set(old['seen'])
+            max_mr = pd.Series([max_mr, old['max_mr']], dtype='float64').max()
+
+        watermarks[location] = {
+            'date': None if pd.isna(latest) else latest.date().isoformat(),
+            'seen': sorted(int(mr) for mr in seen),
+            'max_mr': None if pd.isna(max_mr) else int(max_mr),
+        }
+    return watermarks
+
+
+def _rows_after(df, watermarks):
+    """Rows of `df` that are not yet covered by the stored per-location watermarks"""
+    locations = _location_keys(df)
+    dates = pd.to_datetime(df['RegistrationDate'], format='%d/%m/%y', errors='coerce')
+    mr_numbers = pd.to_numeric(df['RRH_MR_NUM'], errors='coerce')
+
+    known = locations.isin(list(watermarks))
+    watermark_dates = pd.to_datetime(locations.map({loc: wm['date'] for loc, wm in watermarks.items()}))
+    watermark_mrs = pd.to_numeric(locations.map({loc: wm['max_mr'] for loc, wm in watermarks.items()}))
+
+    # MR numbers are numbered per location, so boundary-day rows only match their own location's seen set
+    seen = np.zeros(len(df), dtype=bool)
+    for location, watermark in watermarks.items():
+        at_location = (locations == location).to_numpy()
+        seen[at_location] = mr_numbers[at_location].isin(watermark['seen']).to_numpy()
+
+    # A location whose earlier rows were all undated has no date watermark: every dated row is new
+    newer = (dates > watermark_dates) | (dates.notna() & watermark_dates.isna())
+    same_day_unseen = (dates == watermark_dates) & ~seen
+    undated_newer = dates.isna() & (mr_numbers > watermark_mrs)
+    return df[~known | newer | same_day_unseen | undated_newer]
+
+
+def _load_watermarks():
+    if not Path(WATERMARK_FILE).exists():
+        return None
+    with open(WATERMARK_FILE) as f:
+        return json.load(f)
+
+
+def _save_watermarks(watermarks):
+    tmp_file = WATERMARK_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(tmp_file, WATERMARK_FILE)
 
-            # Convert pincode to numeric
-            df['CPA_PIN_CODE'] = pd.to_numeric(df['CPA_PIN_CODE'], errors='coerce')
 
-            # Drop rows with invalid pincodes
-            original_count = len(df)
-            df = df.dropna(subset=['CPA_PIN_CODE'])
-            dropped = original_count - len(df)
+def merge_address_files(incremental=False):
+    """
+    Merge Address Details.csv and TNAddress.csv into a single combined CSV
 
-            print(f"  - Loaded {len(df)} records")
-            if dropped > 0:
-                print(f"  - Dropped {dropped} records with invalid pincodes")
-            print(f"  - Unique pincodes: {df['CPA_PIN_CODE'].nunique()}")
+    With `incremental`, only rows past each source's watermark (latest
+    RegistrationDate per location, with RRH_MR_NUM to resolve the boundary
+    day) are appended to the existing combined file. A full merge is done
+    when there is no combined file or watermark file yet.
+    """
 
-            dataframes.append(df)
-        else:
+    print("=" * 60)
+    print("Merging Address CSV Files")
+    print("=" * 60)
+
+    watermarks = _load_watermarks() if incremental else None
+    if incremental and (watermarks is None or not Path(OUTPUT_FILE).exists()):
+        print("\n⚠️  No previous merge found - running a full merge")
+        incremental = False
+
+    if incremental:
+        return _append_new_rows(watermarks)
+
+    for csv_file in SOURCE_FILES:
+        if not Path(csv_file).exists():
             print(f"\n❌ {csv_file} NOT FOUND")
             return False
 
-    # Combine all dataframes
-    print(f"\nMerging {len(dataframes)} files...")
-    combined_df = pd.concat(dataframes, ignore_index=True)
+    # Stream every source into a temporary file, one chunk at a time
+    output_columns = _output_columns(SOURCE_FILES)
+    tmp_file = OUTPUT_FILE + '.tmp'
+    pd.DataFrame(columns=output_columns).to_csv(tmp_file, index=False)
+    watermarks = {}
+    all_pincodes = np.empty(0, dtype=np.int64)
+    total_records = 0
+    sample = None
+
+    for csv_file in SOURCE_FILES:
+        print(f"\nLoading {csv_file}...")
+        records = dropped = 0
+        pincodes = np.empty(0, dtype=np.int64)
+        source_watermarks = {}
 
-    # Save to new file
-    output_file = 'Combined_Address_Details.csv'
-    combined_df.to_csv(output_file, index=False)
+        for chunk, chunk_dropped in iter_source_chunks(csv_file):
+            chunk = chunk.reindex(columns=output_columns)
+            chunk.to_csv(tmp_file, mode='a', header=False, index=False)
 
-    print(f"\n✅ Successfully created {output_file}")
-    print(f"   Total records: {len(combined_df):,}")
-    print(f"   Unique pincodes: {combined_df['CPA_PIN_CODE'].nunique()}")
-    print(f"   Columns: {', '.join(combined_df.columns)}")
+            records += len(chunk)
+            dropped += chunk_dropped
+            pincodes = np.union1d(pincodes, chunk['CPA_PIN_CODE'].to_numpy(dtype=np.int64))
+            source_watermarks = _compute_watermarks(chunk, source_watermarks)
+            if sample is None:
+                sample = chunk.head()
+
+        print(f"  - Loaded {records} records")
+        if dropped > 0:
+            print(f"  - Dropped {dropped} records with invalid pincodes")
+        print(f"  - Unique pincodes: {len(pincodes)}")
+
+        total_records += records
+        all_pincodes = np.union1d(all_pincodes, pincodes)
+        watermarks[csv_file] = source_watermarks
+
+    print(f"\nMerged {len(SOURCE_FILES)} files")
+
+    # Replace the combined file only once it has been written completely
+    os.replace(tmp_file, OUTPUT_FILE)
+    _save_watermarks(watermarks)
+
+    print(f"\n✅ Successfully created {OUTPUT_FILE}")
+    print(f"   Total records: {total_records:,}")
+    print(f"   Unique pincodes: {len(all_pincodes)}")
+    print(f"   Columns: {', '.join(output_columns)}")
 
     # Show sample data
     print("\nSample data (first 5 rows):")
-    print(combined_df.head())
+    print(sample)
+
+    print("\n" + "=" * 60)
+    return True
+
+
+def _append_new_rows(watermarks):
+    """Append rows past each source's watermark to the combined file"""
+    for csv_file in SOURCE_FILES:
+        if not Path(csv_file).exists():
+            print(f"\n❌ {csv_file} NOT FOUND")
+            return False
+
+    # Append to a copy, so an interrupted run leaves the combined file and watermarks as they were
+    output_columns = pd.read_csv(OUTPUT_FILE, nrows=0).columns
+    tmp_file = OUTPUT_FILE + '.tmp'
+    shutil.copyfile(OUTPUT_FILE, tmp_file)
+    total_appended = 0
+    updated_watermarks = dict(watermarks)
 
+    for csv_file in SOURCE_FILES:
+        print(f"\nLoading {csv_file}...")
+        records = dropped = appended = 0
+
+        # Filter every chunk against the watermarks from the previous run
+        source_watermarks = watermarks.get(csv_file, {})
+        for chunk, chunk_dropped in iter_source_chunks(csv_file):
+            new_rows = _rows_after(chunk, source_watermarks)
+            records += len(chunk)
+            dropped += chunk_dropped
+
+            if len(new_rows) > 0:
+                new_rows.reindex(columns=output_columns).to_csv(tmp_file, mode='a', header=False, index=False)
+                updated_watermarks[csv_file] = _compute_watermarks(new_rows, updated_watermarks.get(csv_file))
+                appended += len(new_rows)
+
+        print(f"  - {records} records in source, {appended} new since last merge")
+        if dropped > 0:
+            print(f"  - Dropped {dropped} records with invalid pincodes")
+        total_appended += appended
+
+    # Replace the combined file only once every new row is written, then move the watermarks past them
+    os.replace(tmp_file, OUTPUT_FILE)
+    _save_watermarks(updated_watermarks)
+
+    print(f"\n✅ Appended {total_appended:,} new records to {OUTPUT_FILE}")
     print("\n" + "=" * 60)
     return True
 
+
 if __name__ == "__main__":
-    merge_address_files()
+    parser = argparse.ArgumentParser(description="Merge the address extracts into Combined_Address_Details.csv")
+    parser.add_argument('--incremental', action='store_true',
+                        help="append only rows added to the sources since the last merge")
+    args = parser.parse_args()
+    merge_address_files(incremental=args.incremental)
@@ -0,0 +1,318 @@
+"""
+Pincode boundary polygons for the choropleth view, pre-simplified per zoom tier.
+
+The boundary GeoJSON (Polygon or MultiPolygon features with a pincode
+property) is read once and simplified for every zoom tier with
+Douglas-Peucker in Web Mercator pixels, with a tolerance of one screen pixel
+at the deepest zoom of the tier. Coordinates are then quantized to the
+decimals that still resolve that pixel, and rings that collapse at that
+scale are dropped. A pincode left without any polygon is kept as its
+quantized bounding box, so pincodes with data never vanish from the map when
+zoomed out. Tiers are simplified from the deepest down, each from the
+result of the previous one, so the pass over the full detail only runs once.
+
+Every tier is stored as flat integer arrays (quantized coordinates plus
+polygon and ring offsets) in one .npz file next to the frame snapshots,
+keyed by the signature of the GeoJSON file. Later runs only load the arrays
+and slice out the polygons of the pincodes that have data.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from pincode_clusters import TILE_SIZE, world_pixels
+from snapshot_cache import CACHE_DIR, remove_stale, snapshot_path
+
+BOUNDARY_FILE = 'pincode_boundaries.geojson'
+
+# Layout version of the cached tiers: bump when the simplification or the arrays change
+BOUNDARY_VERSION = 2
+
+# Deepest zoom of every tier: a map zoom uses the first tier at or beyond it
+ZOOM_TIERS = [6, 9, 12, 15]
+TOLERANCE_PIXELS = 1.0
+
+# Property holding the pincode, by the names used in the common boundary datasets
+PINCODE_PROPERTIES = ['pincode', 'Pincode', 'PINCODE', 'pin_code', 'PIN_CODE', 'pin', 'PIN']
+
+
+def douglas_peucker(x, y, tolerance, anchors=None):
+    """
+    Mask of the points kept by Douglas-Peucker simplification of the line
+    through `x`, `y`. The `anchors` (positions) are always kept and split the
+    points into independent lines, e.g. one closed ring per anchor pair.
+
+    All open segments are split at once per round, so the number of Python
+    iterations is the depth of the recursion, not the number of points kept.
+    """
+    keep = np.zeros(len(x), dtype=bool)
+    keep[[0, -1]] = True
+    if anchors is not None:
+        keep[anchors] = True
+    resolved = keep.copy()
+
+    while not resolved.all():
+        kept = np.flatnonzero(keep)
+        active = np.flatnonzero(~resolved)
+        segment = np.searchsorted(kept, active) - 1
+        start, end = kept[segment], kept[segment + 1]
+
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[active] - x[start], y[active] - y[start]
+        length = np.hypot(dx, dy)
+        # Distance to the chord, or to the start point when the chord closes a ring
+        distances = np.where(length > 0, np.abs(px * dy - py * dx) / np.where(length > 0, length, 1), np.hypot(px, py))
+
+        # Farthest distance per segment (active points are sorted, so segments are contiguous)
+        bounds = np.flatnonzero(np.r_[True, segment[1:] != segment[:-1]])
+        farthest = np.repeat(np.maximum.reduceat(distances, bounds), np.diff(np.r_[bounds, len(active)]))
+
+        # Split every segment beyond the tolerance at its (first) farthest point, the rest are final
+        splits = np.flatnonzero((distances == farthest) & (distances > tolerance))
+        splits = splits[np.unique(segment[splits], return_index=True)[1]]
+        keep[active[splits]] = True
+        resolved[active[splits]] = True
+        resolved[active[farthest <= tolerance]] = True
+    return keep
+
+
+def tier_decimals(zoom):
+    """Coordinate decimals that resolve TOLERANCE_PIXELS at `zoom`"""
+    degrees_per_pixel = 360 / (TILE_SIZE * 2 ** zoom) * TOLERANCE_PIXELS
+    return int(np.ceil(-np.log10(degrees_per_pixel)))
+
+
+def _counts_to_offsets(counts):
+    return np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+
+def _ranges(starts, lengths):
+    """Positions of the slices [start, start + length), concatenated"""
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    return np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+
+def _bounding_boxes(coords, starts, scale):
+    """
+    Closed counter-clockwise rings ((n, 5, 2) int32) around the points from
+    every start to the next, at least one quantization unit wide and high.
+    """
+    low = np.floor(np.minimum.reduceat(coords, starts) * scale).astype(np.int64)
+    high = np.maximum(np.ceil(np.maximum.reduceat(coords, starts) * scale).astype(np.int64), low + 1)
+    (x0, y0), (x1, y1) = low.T, high.T
+    return np.stack([np.stack(corner, axis=1) for corner in
+                     [(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]], axis=1).astype(np.int32)
+
+
+def simplify_tier(source, zoom):
+    """
+    Tier arrays for `zoom` from `source` (same layout, with coordinates in
+    degrees): rings simplified and quantized to integers in units of
+    10^-tier_decimals(zoom) degrees. Rings that collapse are dropped, and so
+    are polygons whose outer ring collapses; pincodes left without polygons
+    get their bounding box instead.
+    """
+    coords = source['coords']
+    ring_offsets = source['ring_offsets']
+    polygon_offsets = source['polygon_offsets']
+    feature_offsets = source['feature_offsets']
+    n_rings, n_polygons, n_features = len(ring_offsets) - 1, len(polygon_offsets) - 1, len(feature_offsets) - 1
+
+    # Simplify every ring at once: the first and last point of each ring are anchors
+    x, y = world_pixels(coords[:, 1], coords[:, 0])
+    anchors = np.concatenate([ring_offsets[:-1], ring_offsets[1:] - 1])
+    keep = douglas_peucker(x, y, TOLERANCE_PIXELS / 2 ** zoom, anchors) if len(coords) else np.zeros(0, dtype=bool)
+
+    decimals = tier_decimals(zoom)
+    quantized = np.round(coords[keep] * 10 ** decimals).astype(np.int32)
+    point_rings = np.repeat(np.arange(n_rings), np.diff(ring_offsets))[keep]
+
+    # Points that quantize onto their predecessor in the same ring carry no detail
+    repeated = np.zeros(len(quantized), dtype=bool)
+    repeated[1:] = (point_rings[1:] == point_rings[:-1]) & (quantized[1:] == quantized[:-1]).all(axis=1)
+    quantized, point_rings = quantized[~repeated], point_rings[~repeated]
+
+    lengths = np.bincount(point_rings, minlength=n_rings)
+    firsts = _counts_to_offsets(lengths)[:-1]
+    closed = np.zeros(n_rings, dtype=bool)
+    long_enough = lengths >= 4
+    ends = firsts[long_enough] + lengths[long_enough] - 1
+    closed[long_enough] = (quantized[firsts[long_enough]] == quantized[ends]).all(axis=1)
+
+    ring_polygons = np.repeat(np.arange(n_polygons), np.diff(polygon_offsets))
+    polygon_features = np.repeat(np.arange(n_features), np.diff(feature_offsets))
+    polygon_kept = closed[polygon_offsets[:-1]]
+    ring_kept = closed & polygon_kept[ring_polygons]
+    feature_kept = np.bincount(polygon_features, weights=polygon_kept, minlength=n_features) > 0
+
+    polygons_per_feature = np.bincount(polygon_features[polygon_kept], minlength=n_features)
+    rings_per_polygon = np.bincount(ring_polygons[ring_kept], minlength=n_polygons)[polygon_kept]
+    ring_lengths = lengths[ring_kept]
+    kept_coords = quantized[ring_kept[point_rings]]
+
+    # Pincodes whose every polygon collapsed get one polygon: a box around their source points
+    collapsed = np.flatnonzero(~feature_kept)
+    feature_points = ring_offsets[polygon_offsets[feature_offsets[:-1]]]
+    boxes = _bounding_boxes(coords, feature_points, 10 ** decimals)[collapsed] if n_features else np.empty((0, 5, 2))
+
+    # Kept polygons, rings and points first, then one polygon, ring and box per collapsed pincode
+    n_kept_polygons, n_kept_rings = len(rings_per_polygon), len(ring_lengths)
+    polygon_starts = np.zeros(n_features, dtype=np.int64)
+    polygon_starts[feature_kept] = _counts_to_offsets(polygons_per_feature[feature_kept])[:-1]
+    polygon_starts[collapsed] = n_kept_polygons + np.arange(len(collapsed))
+    polygons_per_feature[collapsed] = 1
+    all_rings_per_polygon = np.concatenate([rings_per_polygon, np.ones(len(collapsed), dtype=np.int64)])
+    polygon_ring_starts = np.concatenate([_counts_to_offsets(rings_per_polygon)[:-1],
+                                          n_kept_rings + np.arange(len(collapsed))])
+    all_ring_lengths = np.concatenate([ring_lengths, np.full(len(collapsed), 5, dtype=np.int64)])
+    ring_point_starts = np.concatenate([_counts_to_offsets(ring_lengths)[:-1],
+                                        len(kept_coords) + 5 * np.arange(len(collapsed))])
+    all_coords = np.concatenate([kept_coords, boxes.reshape(-1, 2)]).astype(np.int32)
+
+    # ... gathered back into pincode order
+    polygons = _ranges(polygon_starts, polygons_per_feature)
+    rings = _ranges(polygon_ring_starts[polygons], all_rings_per_polygon[polygons])
+    points = _ranges(ring_point_starts[rings], all_ring_lengths[rings])
+    return {
+        'pincodes': source['pincodes'],
+        'feature_offsets': _counts_to_offsets(polygons_per_feature),
+        'polygon_offsets': _counts_to_offsets(all_rings_per_polygon[polygons]),
+        'ring_offsets': _counts_to_offsets(all_ring_lengths[rings]),
+        'coords': all_coords[points],
+        'decimals': np.asarray(decimals),
+    }
+
+
+class PincodeBoundaries:
+    """Simplified boundary polygons of every zoom tier, as flat arrays sorted by pincode"""
+
+    def __init__(self, tiers):
+        # {tier zoom: {'pincodes', 'feature_offsets', 'polygon_offsets', 'ring_offsets', 'coords', 'decimals'}}
+        self.tiers = tiers
+
+    @classmethod
+    def from_geojson(cls, path):
+        """Read a GeoJSON file of pincode boundaries and simplify it for every tier"""
+        with open(path, encoding='utf-8') as f:
+            features = json.load(f).get('features', [])
+
+        polygons = {}
+        for feature in features:
+            properties = feature.get('properties') or {}
+            geometry = feature.get('geometry') or {}
+            name = next((name for name in PINCODE_PROPERTIES if properties.get(name) not in (None, '')), None)
+            if name is None or geometry.get('type') not in ('Polygon', 'MultiPolygon'):
+                continue
+            try:
+                pincode = int(float(properties[name]))
+            except (TypeError, ValueError):
+                continue
+            parts = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+            for polygon in parts:
+                # Rings may carry a third (altitude) coordinate
+                rings = [np.asarray(ring, dtype=float)[:, :2] for ring in polygon if len(ring) >= 4]
+                if rings:
+                    polygons.setdefault(pincode, []).append(rings)
+
+        # Flat arrays sorted by pincode (a pincode split over several features gets all their polygons)
+        pincodes = sorted(polygons)
+        all_polygons = [polygon for pincode in pincodes for polygon in polygons[pincode]]
+        all_rings = [ring for polygon in all_polygons for ring in polygon]
+        source = {
+            'pincodes': np.asarray(pincodes, dtype=np.int64),
+            'feature_offsets': _counts_to_offsets([len(polygons[pincode]) for pincode in pincodes]),
+            'polygon_offsets': _counts_to_offsets([len(polygon) for polygon in all_polygons]),
+            'ring_offsets': _counts_to_offsets([len(ring) for ring in all_rings]),
+            'coords': np.concatenate(all_rings) if all_rings else np.empty((0, 2)),
+        }
+
+        # From the deepest tier down, each coarser tier simplifying the previous one
+        tiers = {}
+        for zoom in sorted(ZOOM_TIERS, reverse=True):
+            tiers[zoom] = simplify_tier(source, zoom)
+            source = dict(tiers[zoom], coords=tiers[zoom]['coords'] / 10 ** tiers[zoom]['decimals'])
+        return cls(tiers)
+
+    def save(self, path):
+        """Write every tier to one .npz file at `path`"""
+        arrays = {f"z{zoom}_{name}": values for zoom, tier in self.tiers.items() for name, values in tier.items()}
+        tmp_path = path.with_suffix('.tmp.npz')
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path):
+        """Read a file written by `save`"""
+        tiers = {}
+        with np.load(path) as arrays:
+            for key in arrays.files:
+                zoom, name = key[1:].split('_', 1)
+                tiers.setdefault(int(zoom), {})[name] = arrays[key]
+        return cls(tiers)
+
+    def tier(self, zoom):
+        """Zoom tier whose simplification suits a map at `zoom`"""
+        return next((tier for tier in sorted(self.tiers) if tier >= zoom), max(self.tiers))
+
+    def _positions(self, pincodes, zoom):
+        """(found, positions) of `pincodes` in the tier for `zoom`"""
+        known = self.tiers[self.tier(zoom)]['pincodes']
+        pincodes = np.asarray(pincodes, dtype=np.int64)
+        if len(known) == 0:
+            return np.zeros(len(pincodes), dtype=bool), np.zeros(len(pincodes), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(known, pincodes), len(known) - 1)
+        return known[positions] == pincodes, positions
+
+    def contains(self, pincodes, zoom):
+        """Mask of the `pincodes` that have a boundary at `zoom`"""
+        return self._positions(pincodes, zoom)[0]
+
+    def geometries(self, pincodes, zoom):
+        """
+        (found, polygons): which of `pincodes` have a boundary, and the
+        MultiPolygon coordinates ([[[lon, lat], ...], ...] per polygon) of
+        those that do, in the order of `pincodes`.
+        """
+        tier = self.tiers[self.tier(zoom)]
+        found, positions = self._positions(pincodes, zoom)
+
+        feature_offsets, polygon_offsets = tier['feature_offsets'], tier['polygon_offsets']
+        ring_offsets = tier['ring_offsets']
+        decimals = int(tier['decimals'])
+        geometries = []
+        for position in positions[found]:
+            polygons = []
+            for polygon in range(feature_offsets[position], feature_offsets[position + 1]):
+                first_ring, last_ring = polygon_offsets[polygon], polygon_offsets[polygon + 1]
+                coords = tier['coords'][ring_offsets[first_ring]:ring_offsets[last_ring]]
+                coords = np.round(coords / 10 ** decimals, decimals).tolist()
+                starts = ring_offsets[first_ring:last_ring + 1] - ring_offsets[first_ring]
+                polygons.append([coords[start:stop] for start, stop in zip(starts[:-1], starts[1:])])
+            geometries.append(polygons)
+        return found, geometries
+
+
+def load_pincode_boundaries(geojson_file=BOUNDARY_FILE):
+    """Simplified boundaries of `geojson_file` (None without the file), loaded from the cache when fresh"""
+    if not os.path.exists(geojson_file):
+        return None
+    path = snapshot_path('pincode-boundaries', [geojson_file], BOUNDARY_VERSION, suffix='.npz')
+
+    if path.exists():
+        try:
+            return PincodeBoundaries.open(path)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"⚠️  Ignoring unreadable boundary cache {path}: {e}")
+
+    boundaries = PincodeBoundaries.from_geojson(geojson_file)
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        boundaries.save(path)
+        remove_stale('pincode-boundaries', keep=[path])
+    except OSError as e:
+        # Caching is an optimisation only - the freshly simplified boundaries are still usable
+        print(f"⚠️  Could not write boundary cache {path}: {e}")
+    return boundaries
@@ -0,0 +1,148 @@
+"""
+Server-side grid clustering of the pincode markers.
+
+Pincode locations are projected to Web Mercator pixels and snapped to a grid
+of `radius`-pixel cells at the deepest zoom level. The cell size in degrees
+doubles with every zoom level out, so the cells of a coarser level are the
+finer cell coordinates shifted right by one bit: every level is derived from
+the same integer grid and clusters nest across zoom levels, like a
+supercluster hierarchy. Cluster sums, percentages, centroids and bounds are
+computed for every level up front, so the map only has to receive the
+clusters of its current zoom and the browser never walks child markers.
+
+When the number of markers is capped, only the biggest pincodes (the head of
+the count-sorted summary) go through the regular clusters; the long tail of
+small pincodes is folded into aggregates on a coarser grid.
+"""
+
+import numpy as np
+import pandas as pd
+
+TILE_SIZE = 256
+
+# Web Mercator is undefined at the poles
+MAX_LATITUDE = 85.05112878
+
+
+def world_pixels(latitudes, longitudes):
+    """Web Mercator pixel coordinates at zoom 0 (one 256 px tile covers the world)"""
+    latitudes = np.clip(np.asarray(latitudes, dtype=float), -MAX_LATITUDE, MAX_LATITUDE)
+    x = (np.asarray(longitudes, dtype=float) + 180) / 360 * TILE_SIZE
+    sin_lat = np.sin(np.radians(latitudes))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * TILE_SIZE
+    return x, y
+
+
+class GridClusters:
+    """
+    Nested grid clusters of weighted points for every zoom level from `min_zoom` to `max_zoom`.
+
+    Cluster percentages are relative to `total`, which defaults to the sum of
+    `counts` (pass the overall total when clustering a subset of the points).
+    """
+
+    def __init__(self, latitudes, longitudes, counts, min_zoom=0, max_zoom=16, radius=60, total=None):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self.total = int(self.counts.sum()) if total is None else int(total)
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+
+        # Grid cell of every point at the deepest level
+        x, y = world_pixels(self.latitudes, self.longitudes)
+        scale = 2.0 ** max_zoom / radius
+        cell_x = np.floor(x * scale).astype(np.int64)
+        cell_y = np.floor(y * scale).astype(np.int64)
+
+        self.labels = {}
+        self.levels = {}
+        for zoom in range(min_zoom, max_zoom + 1):
+            shift = max_zoom - zoom
+            keys = ((cell_x >> shift) << 32) | (cell_y >> shift)
+            self.labels[zoom], self.levels[zoom] = self._aggregate(keys)
+
+        # Past the deepest level every point is shown on its own
+        self._points = self._aggregate(np.arange(len(self.counts)))
+
+    def _aggregate(self, keys):
+        """Cluster label per point and one row per cluster for points grouped by `keys`"""
+        _, labels = np.unique(keys, return_inverse=True)
+        labels = labels.reshape(-1)
+        n_clusters = int(labels.max()) + 1 if len(labels) else 0
+
+        n_points = np.bincount(labels, minlength=n_clusters)
+        counts = np.bincount(labels, weights=self.counts, minlength=n_clusters)
+
+        # Count-weighted centroid, so the bubble sits where the demand is
+        weights = np.maximum(self.counts, 1)
+        weight_sums = np.bincount(labels, weights=weights, minlength=n_clusters)
+        latitudes = np.bincount(labels, weights=self.latitudes * weights, minlength=n_clusters) / weight_sums
+        longitudes = np.bincount(labels, weights=self.longitudes * weights, minlength=n_clusters) / weight_sums
+
+        south = np.full(n_clusters, np.inf)
+        west = np.full(n_clusters, np.inf)
+        north = np.full(n_clusters, -np.inf)
+        east = np.full(n_clusters, -np.inf)
+        np.minimum.at(south, labels, self.latitudes)
+        np.minimum.at(west, labels, self.longitudes)
+        np.maximum.at(north, labels, self.latitudes)
+        np.maximum.at(east, labels, self.longitudes)
+
+        # Position of the only point of single-point clusters (-1 for real clusters)
+        point = np.full(n_clusters, -1, dtype=np.int64)
+        point[labels] = np.arange(len(labels))
+        point[n_points > 1] = -1
+
+        clusters = pd.DataFrame({
+            'Latitude': latitudes,
+            'Longitude': longitudes,
+            'count': counts.astype(np.int64),
+            'percentage': counts / self.total * 100 if self.total else np.zeros(n_clusters),
+            'n_points': n_points,
+            'south': south,
+            'west': west,
+            'north': north,
+            'east': east,
+            'point': point,
+        })
+        return labels, clusters
+
+    def _zoom_level(self, zoom):
+        return min(max(int(round(zoom)), self.min_zoom), self.max_zoom + 1)
+
+    def level(self, zoom):
+        """Clusters shown at `zoom` (single-point clusters have `point` set to the point's position)"""
+        zoom = self._zoom_level(zoom)
+        return self._points[1] if zoom > self.max_zoom else self.levels[zoom]
+
+    def point_labels(self, zoom):
+        """Cluster of every point at `zoom` (row positions in `level(zoom)`)"""
+        zoom = self._zoom_level(zoom)
+        return self._points[0] if zoom > self.max_zoom else self.labels[zoom]
+
+
+def detail_split(counts, max_points=None):
+    """
+    Number of leading points of `counts` (sorted in descending order) that are
+    drawn individually: at most `max_points`, and only those above the count
+    of the first point left out, so that pincodes with the same count are
+    never split between the two sides. None draws every point.
+    """
+    counts = np.asarray(counts)
+    if max_points is None or len(counts) <= max_points:
+        return len(counts)
+    # First position whose count is not above the threshold
+    return int(np.searchsorted(-counts, -counts[max_points], side='left'))
+
+
+def tail_clusters(latitudes, longitudes, counts, zoom, coarsening=2, radius=60, total=None):
+    """
+    Aggregates of the long tail of small pincodes at `zoom`: every point is
+    folded into a grid cell `coarsening` zoom levels coarser than the regular
+    clusters, whether or not it has neighbours. Same columns as `GridClusters.level`.
+    """
+    tail_zoom = min(max(int(round(zoom)) - coarsening, 0), 16)
+    clusters = GridClusters(latitudes, longitudes, counts, min_zoom=tail_zoom, max_zoom=tail_zoom,
+                            radius=radius, total=total)
+    return clusters.level(tail_zoom)
@@ -0,0 +1,86 @@
+"""
+Pre-aggregated pincode x year x patient-type count cube.
+
+The cube is built once per data load with a single bincount pass over the
+prepared frame. Every filter combination in the dashboards is then answered
+by slicing and summing the dense cube, so the cost of a rerun depends on the
+number of pincodes instead of the number of patient rows.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _factorize(series):
+    """Sorted integer codes for `series` plus the labels they refer to (missing values get -1)"""
+    codes, labels = pd.factorize(series, sort=True)
+    return codes, np.asarray(labels)
+
+
+class PincodeCube:
+    """Dense counts indexed by (pincode, year, patient type)"""
+
+    def __init__(self, df, type_column=None):
+        pin_codes, self.pincodes = _factorize(df['CPA_PIN_CODE'])
+        year_codes, years = _factorize(df['Year'])
+        self.years = years.astype(int)
+
+        if type_column is not None:
+            type_codes, self.types = _factorize(df[type_column])
+        else:
+            # Single slot so the same slicing code works for frames without a type column
+            type_codes, self.types = np.zeros(len(df), dtype=np.intp), np.array(['All'])
+
+        # Rows with an unknown year go to an extra trailing slot: they count
+        # towards "All Years" but never match a specific year
+        year_codes = np.where(year_codes < 0, len(self.years), year_codes)
+
+        shape = (len(self.pincodes), len(self.years) + 1, len(self.types))
+        flat_index = np.ravel_multi_index((pin_codes, year_codes, type_codes), shape)
+        self.counts = np.bincount(flat_index, minlength=np.prod(shape)).astype(np.int32).reshape(shape)
+
+        self._year_slot = {int(year): i for i, year in enumerate(self.years)}
+
+    def type_matrix(self, year=None, patient_type=None):
+        """Pincode x patient-type counts for the selection (unselected types are zero)"""
+        cube = self.counts
+        if year is not None:
+            slot = self._year_slot.get(int(year))
+            cube = cube[:, slot:slot + 1, :] if slot is not None else cube[:, :0, :]
+        matrix = cube.sum(axis=1)
+        if patient_type is not None:
+            matrix = np.where(self.types == str(patient_type), matrix, 0)
+        return matrix
+
+    def pincode_counts(self, year=None, patient_type=None):
+        """Total count per pincode for the selection (aligned with `self.pincodes`)"""
+        return self.type_matrix(year, patient_type).sum(axis=1)
+
+    def summary(self, count_name, year=None, patient_type=None, with_type_mix=False):
+        """Frame of pincodes with at least one record in the selection and their counts"""
+        matrix = self.type_matrix(year, patient_type)
+        return summarize_type_matrix(matrix, self.pincodes, self.types, count_name, with_type_mix)
+
+
+def summarize_type_matrix(matrix, pincodes, types, count_name, with_type_mix=False):
+    """
+    Frame of pincodes with at least one record in a pincode x patient-type matrix.
+
+    With `with_type_mix`, every patient type also gets a `<type>_count` and a
+    `<type>_share` (percent of the pincode's records) column, computed from
+    the matrix in one vectorized pass.
+    """
+    present = matrix.any(axis=1)
+    counts = matrix[present]
+    totals = counts.sum(axis=1)
+
+    columns = {
+        'CPA_PIN_CODE': pincodes[present],
+        count_name: totals,
+    }
+    if with_type_mix:
+        shares = counts / np.maximum(totals, 1)[:, None] * 100
+        for i, patient_type in enumerate(types):
+            columns[f'{patient_type}_count'] = counts[:, i]
+            columns[f'{patient_type}_share'] = shares[:, i]
+    return pd.DataFrame(columns)
@@ -0,0 +1,140 @@
+"""
+Shared data preparation for the address and surgery dashboards.
+
+Both dashboards read a patient/customer CSV, clean the pincodes, parse the
+registration date and attach Google Maps coordinates per pincode. The
+prepared frames are served through the columnar snapshot cache so that only
+the first start after a data change pays for the CSV parse.
+"""
+
+import pandas as pd
+
+from pincode_lookup import load_pincode_lookup
+from snapshot_cache import load_snapshot
+
+ADDRESS_FILE = 'Combined_Address_Details.csv'
+SURGERY_FILE = 'BlrSurgeryOnly.csv'
+PINCODE_COORDS_FILE = 'pincode_coordinates_google.csv'
+
+# Layout version of the snapshots: bump when the prepared frames change shape or order
+FRAME_VERSION = 3
+
+# Compact column schema of the prepared frames. Columns not listed here
+# (MR number, location code, raw Google city, duplicate pincode) are never
+# read by the dashboards and are dropped. Year and month use nullable integer
+# types because some registration dates fail to parse.
+FRAME_SCHEMA = {
+    'CPA_PIN_CODE': 'int32',
+    'CPA_ADDR_AREA': 'category',
+    'CPA_ADDR_CITY': 'category',
+    'StateName': 'category',
+    'BSM_MINOR_CD': 'category',
+    'RegistrationDate': 'datetime64[ns]',
+    'Year': 'Int16',
+    'Month': 'UInt8',
+    'Latitude': 'float32',
+    'Longitude': 'float32',
+}
+
+
+def _prepare_records(records_df):
+    """Clean pincodes and derive the registration year and month"""
+    # Clean pincodes
+    records_df['CPA_PIN_CODE'] = pd.to_numeric(records_df['CPA_PIN_CODE'], errors='coerce')
+    records_df = records_df.dropna(subset=['CPA_PIN_CODE'])
+
+    # Parse registration date to extract year and month
+    records_df['RegistrationDate'] = pd.to_datetime(records_df['RegistrationDate'], format='%d/%m/%y', errors='coerce')
+    records_df['Year'] = records_df['RegistrationDate'].dt.year
+    records_df['Month'] = records_df['RegistrationDate'].dt.month
+
+    return records_df
+
+
+def _attach_coordinates(records_df):
+    """Attach Google Maps coordinates, city and state to every record"""
+    # Google Maps pincode coordinates (already clean and deduplicated, 1-to-1 mapping),
+    # gathered by pincode offset from the dense lookup table instead of a merge
+    lookup = load_pincode_lookup(PINCODE_COORDS_FILE)
+    located = lookup.gather(records_df['CPA_PIN_CODE'].to_numpy(dtype='int64'))
+
+    records_df = records_df.assign(
+        Latitude=located['latitude'],
+        Longitude=located['longitude'],
+        StateName=lookup.state_labels(located['state']).remove_unused_categories(),
+        # Use Google Maps city if available, otherwise fall back to address city
+        CPA_ADDR_CITY=pd.Series(lookup.city_labels(located['city']), index=records_df.index)
+            .astype(object).fillna(records_df['CPA_ADDR_CITY']),
+    )
+
+    # Drop rows without coordinates
+    return records_df.dropna(subset=['Latitude', 'Longitude'])
+
+
+def sort_by_registration(df):
+    """Order rows by registration date (unparseable dates last) so date windows are contiguous"""
+    return df.sort_values('RegistrationDate', kind='stable', na_position='last')
+
+
+def apply_schema(df):
+    """Keep only the schema columns present in `df` and cast them to their compact dtypes"""
+    schema = {column: dtype for column, dtype in FRAME_SCHEMA.items() if column in df.columns}
+    return df[list(schema)].astype(schema).reset_index(drop=True)
+
+
+def build_pincode_dimension(df):
+    """
+    One row per pincode with its location, city and state.
+
+    Coordinates and state come 1:1 from the Google Maps pincode file. The city
+    falls back to the address city where Google has none, so it is the most
+    common city per pincode, found with a vectorized sort instead of a
+    per-group mode.
+    """
+    locations = df.drop_duplicates('CPA_PIN_CODE')[['CPA_PIN_CODE', 'Latitude', 'Longitude', 'StateName']]
+
+    city_counts = df.groupby(['CPA_PIN_CODE', 'CPA_ADDR_CITY'], observed=True).size().reset_index(name='n')
+    city_counts = city_counts.sort_values(['CPA_PIN_CODE', 'n', 'CPA_ADDR_CITY'], ascending=[True, False, True])
+    cities = city_counts.drop_duplicates('CPA_PIN_CODE')[['CPA_PIN_CODE', 'CPA_ADDR_CITY']]
+
+    dimension = locations.merge(cities, on='CPA_PIN_CODE', how='left')
+    return apply_schema(dimension.sort_values('CPA_PIN_CODE'))
+
+
+def build_address_frame():
+    """Build the customer frame from the combined address file"""
+    # Combined file merges Address Details.csv and TNAddress.csv (see merge_addresses.py)
+    address_df = _prepare_records(pd.read_csv(ADDRESS_FILE))
+    return apply_schema(sort_by_registration(_attach_coordinates(address_df)))
+
+
+def build_surgery_frame():
+    """Build the surgical patient frame"""
+    surgery_df = _prepare_records(pd.read_csv(SURGERY_FILE))
+
+    # Clean patient type - handle variations
+    surgery_df['BSM_MINOR_CD'] = surgery_df['BSM_MINOR_CD'].fillna('Unknown').astype(str).str.strip()
+
+    return apply_schema(sort_by_registration(_attach_coordinates(surgery_df)))
+
+
+def load_address_data():
+    """Prepared customer frame, memory-mapped from the snapshot when fresh"""
+    return load_snapshot('address', [ADDRESS_FILE, PINCODE_COORDS_FILE], build_address_frame, FRAME_VERSION)
+
+
+def load_surgery_data():
+    """Prepared surgical patient frame, memory-mapped from the snapshot when fresh"""
+    return load_snapshot('surgery', [SURGERY_FILE, PINCODE_COORDS_FILE], build_surgery_frame, FRAME_VERSION)
+
+
+def load_address_pincodes():
+    """Pincode dimension table for the customer frame"""
+    return load_snapshot('address-pincodes', [ADDRESS_FILE, PINCODE_COORDS_FILE],
+                         lambda: build_pincode_dimension(load_address_data()), FRAME_VERSION)
+
+
+def load_surgery_pincodes():
+    """Pincode dimension table for the surgical patient frame"""
+    return load_snapshot('surgery-pincodes', [SURGERY_FILE, PINCODE_COORDS_FILE],
+                         lambda: build_pincode_dimension(load_surgery_data()), FRAME_VERSION)
@@ -0,0 +1,200 @@
+"""
+Dense pincode -> coordinate lookup table.
+
+The Google Maps pincode file is turned into one fixed-width record per
+six-digit pincode in the range it covers (latitude, longitude as float32
+and city, state as int16 codes into small label lists), so row
+`pincode - offset` holds that pincode's location. Attaching coordinates to
+a column of pincodes is then a single fancy-index gather instead of a hash
+join. The few malformed pincodes outside `PINCODE_RANGE` get records after
+the dense block, found through a small sorted key array, so one stray value
+cannot stretch the table to millions of slots.
+
+The table is saved next to the frame snapshots as a plain .npy file and
+memory-mapped read-only, so every dashboard process on the box shares the
+same pages through the OS page cache.
+
+The bulky post-office file (many offices per pincode, mixed-type coordinate
+columns) is reduced the same way to one centroid per pincode, with the
+district in place of the city, so joining it never multiplies rows.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from snapshot_cache import CACHE_DIR, remove_stale, snapshot_path
+
+# Layout version of the lookup files: bump when LOOKUP_DTYPE or the label file changes
+LOOKUP_VERSION = 2
+
+# Version of the post-office centroids: bump when `post_office_centroids` changes
+CENTROID_VERSION = 1
+
+# Post offices outside this (south, west, north, east) box have placeholder or swapped coordinates
+INDIA_BOUNDS = (6.0, 68.0, 37.5, 97.5)
+
+# Indian pincodes have six digits; anything else is a data entry error that would stretch the dense table
+PINCODE_RANGE = (100000, 999999)
+
+LOOKUP_DTYPE = np.dtype([
+    ('latitude', np.float32),
+    ('longitude', np.float32),
+    ('city', np.int16),
+    ('state', np.int16),
+])
+
+
+class PincodeLookup:
+    """
+    Location records indexed by `pincode - offset`, followed by one record per
+    out-of-range pincode in `extra` (sorted). Missing entries have NaN
+    coordinates and code -1.
+    """
+
+    def __init__(self, table, offset, cities, states, extra=()):
+        self.table = table
+        self.offset = int(offset)
+        self.cities = np.asarray(cities, dtype=object)
+        self.states = np.asarray(states, dtype=object)
+        self.extra = np.asarray(extra, dtype=np.int64)
+        self.dense_size = len(table) - len(self.extra)
+
+    @classmethod
+    def from_frame(cls, pincode_coords):
+        """Build the table from a frame with pincode, latitude, longitude, city and state columns"""
+        pincodes = pincode_coords['pincode'].to_numpy(dtype=np.int64)
+        in_range = (pincodes >= PINCODE_RANGE[0]) & (pincodes <= PINCODE_RANGE[1])
+        dense = pincodes[in_range]
+        offset = dense.min() if len(dense) else 0
+        size = int(dense.max() - offset + 1) if len(dense) else 0
+        extra = np.unique(pincodes[~in_range])
+
+        table = np.empty(size + len(extra), dtype=LOOKUP_DTYPE)
+        table['latitude'] = np.nan
+        table['longitude'] = np.nan
+        table['city'] = -1
+        table['state'] = -1
+
+        city_codes, cities = pd.factorize(pincode_coords['city'], sort=True)
+        state_codes, states = pd.factorize(pincode_coords['state'], sort=True)
+
+        slots = np.where(in_range, pincodes - offset, size + np.searchsorted(extra, pincodes))
+        table['latitude'][slots] = pincode_coords['latitude'].to_numpy(dtype=np.float32)
+        table['longitude'][slots] = pincode_coords['longitude'].to_numpy(dtype=np.float32)
+        table['city'][slots] = city_codes
+        table['state'][slots] = state_codes
+        return cls(table, offset, cities, states, extra)
+
+    def gather(self, pincodes):
+        """Location records for an array of pincodes (pincodes not in the table get a missing record)"""
+        pincodes = np.asarray(pincodes, dtype=np.int64)
+        slots = pincodes - self.offset
+        found = (slots >= 0) & (slots < self.dense_size)
+        if len(self.extra):
+            positions = np.minimum(np.searchsorted(self.extra, pincodes), len(self.extra) - 1)
+            is_extra = ~found & (self.extra[positions] == pincodes)
+            slots = np.where(is_extra, self.dense_size + positions, slots)
+            found |= is_extra
+        records = self.table[np.where(found, slots, 0)] if len(self.table) else np.empty(len(slots), LOOKUP_DTYPE)
+        records[~found] = (np.nan, np.nan, -1, -1)
+        return records
+
+    def city_labels(self, codes):
+        """City names for `codes` as a categorical (code -1 becomes NaN)"""
+        return pd.Categorical.from_codes(codes, categories=self.cities)
+
+    def state_labels(self, codes):
+        """State names for `codes` as a categorical (code -1 becomes NaN)"""
+        return pd.Categorical.from_codes(codes, categories=self.states)
+
+    def save(self, path):
+        """Write the table to `path` (.npy) and its offset, extra keys and labels to a .json file beside it"""
+        tmp_path = path.with_suffix('.tmp.npy')
+        np.save(tmp_path, self.table)
+        labels = {
+            'offset': self.offset,
+            'extra': [int(pincode) for pincode in self.extra],
+            'cities': [str(city) for city in self.cities],
+            'states': [str(state) for state in self.states],
+        }
+        with open(path.with_suffix('.json'), 'w') as f:
+            json.dump(labels, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map a table written by `save`"""
+        with open(path.with_suffix('.json')) as f:
+            labels = json.load(f)
+        table = np.load(path, mmap_mode='r')
+        return cls(table, labels['offset'], labels['cities'], labels['states'], labels['extra'])
+
+
+def _most_common(frame, column):
+    """Most common non-missing `column` value per pincode (ties go to the first in sort order)"""
+    counts = frame.groupby(['pincode', column]).size().reset_index(name='n')
+    counts = counts.sort_values(['pincode', 'n', column], ascending=[True, False, True])
+    return counts.drop_duplicates('pincode').set_index('pincode')[column]
+
+
+def post_office_centroids(offices_file):
+    """
+    One row per pincode of the post-office file: the median location of its
+    offices with valid coordinates, and its most common district and state.
+    """
+    offices = pd.read_csv(offices_file, usecols=['Pincode', 'District', 'StateName', 'Latitude', 'Longitude'],
+                          dtype=str)
+    pincodes = pd.to_numeric(offices['Pincode'], errors='coerce')
+    latitudes = pd.to_numeric(offices['Latitude'], errors='coerce')
+    longitudes = pd.to_numeric(offices['Longitude'], errors='coerce')
+
+    south, west, north, east = INDIA_BOUNDS
+    valid = pincodes.between(*PINCODE_RANGE) & latitudes.between(south, north) & longitudes.between(west, east)
+    offices = pd.DataFrame({
+        'pincode': pincodes[valid].astype(np.int64),
+        'latitude': latitudes[valid],
+        'longitude': longitudes[valid],
+        'city': offices.loc[valid, 'District'].str.strip(),
+        'state': offices.loc[valid, 'StateName'].str.strip(),
+    })
+
+    # The median keeps a single misplaced office from dragging the centroid away
+    centroids = offices.groupby('pincode')[['latitude', 'longitude']].median()
+    centroids['city'] = _most_common(offices, 'city')
+    centroids['state'] = _most_common(offices, 'state')
+    return centroids.reset_index()
+
+
+def _load_lookup(name, source_file, build_frame, version=LOOKUP_VERSION):
+    """Lookup table of the frame `build_frame(source_file)`, memory-mapped from the cache when fresh"""
+    path = snapshot_path(name, [source_file], version, suffix='.npy')
+
+    if path.exists() and path.with_suffix('.json').exists():
+        try:
+            return PincodeLookup.open(path)
+        except (ValueError, KeyError, OSError) as e:
+            print(f"⚠️  Ignoring unreadable lookup table {path}: {e}")
+
+    lookup = PincodeLookup.from_frame(build_frame(source_file))
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        lookup.save(path)
+        remove_stale(name, keep=[path, path.with_suffix('.json')])
+    except OSError as e:
+        # Caching is an optimisation only - the freshly built table is still usable
+        print(f"⚠️  Could not write lookup table {path}: {e}")
+    return lookup
+
+
+def load_pincode_lookup(coords_file):
+    """Lookup table for `coords_file`, memory-mapped from the cache when fresh"""
+    return _load_lookup('pincode-lookup', coords_file, pd.read_csv)
+
+
+def load_centroid_lookup(offices_file):
+    """Post-office centroid per pincode (district in the city field), memory-mapped from the cache when fresh"""
+    return _load_lookup('pincode-centroids', offices_file, post_office_centroids,
+                        version=f"{LOOKUP_VERSION}.{CENTROID_VERSION}")
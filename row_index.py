@@ -0,0 +1,133 @@
+"""
+Row-position indexes for filtering the prepared frames without copying them.
+
+For every indexed column the row positions are grouped by value once and
+stored as a single int32 array plus offsets, so the rows holding one value
+are a sorted slice (a view) of that array. Combined filters intersect these
+sorted position lists, starting from the shortest, and aggregations run over
+the selected positions only - no boolean mask over the full frame and no
+filtered copy of it is ever built.
+
+The prepared frames are sorted by registration date, so a date window is a
+contiguous range of positions found with `searchsorted`; narrowing each
+sorted position list to that range is again a view.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _key(value):
+    """Normalize numpy scalars so that label lookups work with plain Python values"""
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def intersect_sorted(left, right):
+    """Intersection of two sorted, duplicate-free position arrays"""
+    if len(left) > len(right):
+        left, right = right, left
+    if len(left) == 0:
+        return left
+    slots = np.searchsorted(right, left)
+    found = right[np.minimum(slots, len(right) - 1)] == left
+    return left[found]
+
+
+class RowIndex:
+    """Sorted row positions per value of selected columns"""
+
+    def __init__(self, df, columns, date_column=None):
+        self.n_rows = len(df)
+        self.codes = {}
+        self.labels = {}
+        self._slots = {}
+        self._order = {}
+        self._offsets = {}
+
+        for column in columns:
+            codes, labels = pd.factorize(df[column], sort=True)
+            labels = np.asarray(labels)
+
+            # Stable sort keeps positions ascending within each value; missing
+            # values (code -1) sort first and fall outside every value's slice
+            order = np.argsort(codes, kind='stable').astype(np.int32)
+
+            self.codes[column] = codes.astype(np.int32)
+            self.labels[column] = labels
+            self._slots[column] = {_key(label): i for i, label in enumerate(labels)}
+            self._order[column] = order
+            self._offsets[column] = np.searchsorted(codes[order], np.arange(len(labels) + 1))
+
+        self.dates = None
+        if date_column is not None:
+            # Only the dated prefix is searchable; undated rows sort last
+            dates = df[date_column].to_numpy()
+            dates = dates[:np.count_nonzero(~np.isnat(dates))]
+            if np.any(dates[1:] < dates[:-1]):
+                raise ValueError(f"Frame must be sorted by '{date_column}' to build a date index")
+            self.dates = dates
+
+    def date_bounds(self):
+        """First and last indexed date, or None when no row has a date"""
+        if self.dates is None or len(self.dates) == 0:
+            return None
+        return pd.Timestamp(self.dates[0]), pd.Timestamp(self.dates[-1])
+
+    def _date_positions(self, date_range):
+        """[start, stop) row positions of the half-open date window `date_range`"""
+        start, stop = np.array([pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])], dtype=self.dates.dtype)
+        return np.searchsorted(self.dates, start), np.searchsorted(self.dates, stop)
+
+    def rows(self, column, value):
+        """Sorted positions of the rows where `column == value` (a view, not a copy)"""
+        slot = self._slots[column].get(_key(value))
+        if slot is None:
+            return np.empty(0, dtype=np.int32)
+        offsets = self._offsets[column]
+        return self._order[column][offsets[slot]:offsets[slot + 1]]
+
+    def select(self, filters, date_range=None):
+        """
+        Sorted positions of the rows matching every `{column: value}` filter.
+
+        Filters with a value of None are ignored. `date_range` is a half-open
+        (start, stop) window on the date column. None is returned when no
+        filter is active, meaning "all rows".
+        """
+        selections = [self.rows(column, value) for column, value in filters.items() if value is not None]
+
+        if date_range is not None:
+            start, stop = self._date_positions(date_range)
+            if not selections:
+                return np.arange(start, stop, dtype=np.int32)
+            # Positions are sorted, so the window cuts a slice out of every selection
+            selections = [rows[np.searchsorted(rows, start):np.searchsorted(rows, stop)] for rows in selections]
+
+        if not selections:
+            return None
+
+        selections.sort(key=len)
+        positions = selections[0]
+        for other in selections[1:]:
+            positions = intersect_sorted(positions, other)
+        return positions
+
+    def crosstab(self, positions, row_column, col_column=None):
+        """
+        Counts of (row value, column value) pairs over the selected rows.
+
+        Rows and columns follow the sorted labels of the two columns; without
+        `col_column` the result has a single column. Rows with a missing
+        value in either column are not counted.
+        """
+        row_codes = self.codes[row_column]
+        col_codes = self.codes[col_column] if col_column is not None else np.zeros(self.n_rows, dtype=np.int32)
+        if positions is not None:
+            row_codes = row_codes[positions]
+            col_codes = col_codes[positions]
+
+        n_rows = len(self.labels[row_column])
+        n_cols = len(self.labels[col_column]) if col_column is not None else 1
+        valid = (row_codes >= 0) & (col_codes >= 0)
+        flat_index = row_codes[valid].astype(np.int64) * n_cols + col_codes[valid]
+        return np.bincount(flat_index, minlength=n_rows * n_cols).reshape(n_rows, n_cols)
@@ -0,0 +1,80 @@
+"""
+Columnar snapshot cache for prepared dashboard frames.
+
+Parsing the raw CSVs, converting registration dates and merging pincode
+coordinates takes several seconds on the free Render instance. The fully
+prepared frame is written once to an uncompressed Arrow (Feather v2) file and
+memory-mapped on every later cold start. Snapshots are keyed by the
+modification time and size of each source file, so replacing or editing a CSV
+triggers a rebuild automatically.
+"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Directory holding the snapshot files (ignored by git)
+CACHE_DIR = Path('.snapshot_cache')
+
+
+def source_signature(paths, version=1):
+    """Return a short hash of the format version and (path, mtime, size) for every source file"""
+    parts = [f"v{version}"]
+    for path in paths:
+        stat = os.stat(path)
+        parts.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def snapshot_path(name, sources, version=1, suffix='.feather'):
+    """Path of the snapshot for `name` built from the current state of `sources`"""
+    return CACHE_DIR / f"{name}-{source_signature(sources, version)}{suffix}"
+
+
+def remove_stale(name, keep):
+    """Delete snapshot files of `name` other than those in `keep`"""
+    for stale in CACHE_DIR.glob(f"{name}-*"):
+        # The glob also matches longer names sharing the prefix (e.g. "address-pincodes")
+        if stale not in keep and stale.name.split('.', 1)[0].rsplit('-', 1)[0] == name:
+            stale.unlink(missing_ok=True)
+
+
+def load_snapshot(name, sources, build_fn, version=1):
+    """
+    Return the frame produced by `build_fn`, served from an on-disk snapshot.
+
+    The snapshot is memory-mapped when it matches the current source files,
+    otherwise `build_fn()` is called and its result is written as a new
+    snapshot (replacing stale snapshots with the same name). Bump `version`
+    whenever `build_fn` changes the layout of the frame it returns.
+    """
+    path = snapshot_path(name, sources, version)
+
+    if path.exists():
+        try:
+            table = feather.read_table(path, memory_map=True)
+            return table.to_pandas(split_blocks=True)
+        except (pa.ArrowInvalid, OSError) as e:
+            print(f"⚠️  Ignoring unreadable snapshot {path}: {e}")
+
+    df = build_fn()
+    _write_snapshot(name, path, df)
+    return df
+
+
+def _write_snapshot(name, path, df):
+    """Atomically write `df` to `path` and remove older snapshots of `name`"""
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+    except (pa.ArrowException, OSError) as e:
+        # Caching is an optimisation only - the freshly built frame is still usable
+        print(f"⚠️  Could not write snapshot {path}: {e}")
+        return
+
+    remove_stale(name, keep=[path])
@@ -0,0 +1,132 @@
+"""
+Uniform grid index over point locations.
+
+Points are bucketed into square latitude/longitude cells and their positions
+are stored grouped by cell in a single int32 array plus offsets, the same
+layout as the row indexes in row_index.py. Cells are numbered row by row, so
+the cells of one grid row inside a bounding box are a contiguous key range:
+a box query reads one slice of the position array per grid row and only
+checks the exact bounds for the points in those cells.
+
+Nearest-neighbour queries use the same slices: every location searches a box
+of cells around its own cell, and the box is doubled for the locations whose
+k-th nearest point could still lie outside it.
+"""
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres between arrays of points (degrees)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(values, dtype=float)) for values in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """Positions of points bucketed by `cell_size`-degree grid cells"""
+
+    def __init__(self, latitudes, longitudes, cell_size=0.05):
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.cell_size = cell_size
+
+        if len(self.latitudes):
+            self.origin = (self.latitudes.min(), self.longitudes.min())
+        else:
+            self.origin = (0.0, 0.0)
+        rows, cols = self._cells(self.latitudes, self.longitudes)
+        self.n_rows = int(rows.max()) + 1 if len(rows) else 0
+        self.n_cols = int(cols.max()) + 1 if len(cols) else 0
+
+        keys = rows * self.n_cols + cols
+        self._order = np.argsort(keys, kind='stable').astype(np.int32)
+        self._offsets = np.searchsorted(keys[self._order], np.arange(self.n_rows * self.n_cols + 1))
+
+    def _cells(self, latitudes, longitudes):
+        """Grid row and column of each location (relative to the south-west corner of the data)"""
+        rows = np.floor((latitudes - self.origin[0]) / self.cell_size).astype(np.int64)
+        cols = np.floor((longitudes - self.origin[1]) / self.cell_size).astype(np.int64)
+        return rows, cols
+
+    def query(self, south, west, north, east):
+        """Sorted positions of the points inside the bounding box (edges included)"""
+        if self.n_rows == 0 or south > north or west > east:
+            return np.empty(0, dtype=np.int32)
+
+        (row_start, row_stop), (col_start, col_stop) = self._cells(np.array([south, north]), np.array([west, east]))
+        row_start, row_stop = max(row_start, 0), min(row_stop, self.n_rows - 1)
+        col_start, col_stop = max(col_start, 0), min(col_stop, self.n_cols - 1)
+        if row_start > row_stop or col_start > col_stop:
+            return np.empty(0, dtype=np.int32)
+
+        # One contiguous run of cells per grid row
+        first_cells = np.arange(row_start, row_stop + 1) * self.n_cols + col_start
+        starts = self._offsets[first_cells]
+        stops = self._offsets[first_cells + (col_stop - col_start) + 1]
+        candidates = np.concatenate([self._order[start:stop] for start, stop in zip(starts, stops)])
+
+        lats = self.latitudes[candidates]
+        lons = self.longitudes[candidates]
+        inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+        return np.sort(candidates[inside])
+
+    def nearest(self, latitudes, longitudes, k=1, mask=None):
+        """
+        (positions, distances): the `k` nearest points to every location,
+        nearest first, and their haversine distances in km, both (n, k)
+        arrays, in one batched query. `mask` limits the search to a subset of
+        the points. Rows are padded with -1 and inf where fewer points qualify.
+        """
+        latitudes = np.asarray(latitudes, dtype=float)
+        longitudes = np.asarray(longitudes, dtype=float)
+        positions = np.full((len(latitudes), k), -1, dtype=np.int64)
+        distances = np.full((len(latitudes), k), np.inf)
+        allowed = np.ones(len(self.latitudes), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        if self.n_rows == 0 or k < 1 or not allowed.any():
+            return positions, distances
+
+        # Locations without coordinates are never searched; zeros only keep the cell cast defined
+        rows, cols = self._cells(np.nan_to_num(latitudes), np.nan_to_num(longitudes))
+        pending = np.flatnonzero(np.isfinite(latitudes) & np.isfinite(longitudes))
+        radius = 1
+        while len(pending):
+            # Box of `radius` cells around every pending location, clipped to the grid
+            row_start = np.clip(rows[pending] - radius, 0, self.n_rows - 1)
+            row_stop = np.clip(rows[pending] + radius, -1, self.n_rows - 1)
+            col_start = np.clip(cols[pending] - radius, 0, self.n_cols - 1)
+            col_stop = np.clip(cols[pending] + radius, -1, self.n_cols - 1)
+            grid_rows = row_start[:, None] + np.arange(min(2 * radius + 1, self.n_rows))
+            in_box = (grid_rows <= row_stop[:, None]) & (col_start <= col_stop)[:, None]
+            first_cells = np.where(in_box, grid_rows * self.n_cols + col_start[:, None], 0)
+            starts = self._offsets[first_cells]
+            lengths = np.where(in_box, self._offsets[first_cells + (col_stop - col_start)[:, None] + 1] - starts, 0)
+
+            # Every (location, point) pair of the boxes, one contiguous slice of _order per grid row
+            lengths, starts = lengths.ravel(), starts.ravel()
+            slice_offsets = np.cumsum(lengths) - lengths
+            candidates = self._order[np.arange(lengths.sum()) + np.repeat(starts - slice_offsets, lengths)]
+            queries = np.repeat(np.repeat(pending, grid_rows.shape[1]), lengths)
+            keep = allowed[candidates]
+            candidates, queries = candidates[keep], queries[keep]
+            pair_distances = haversine_km(latitudes[queries], longitudes[queries],
+                                          self.latitudes[candidates], self.longitudes[candidates])
+
+            # The k nearest pairs of every location
+            order = np.lexsort((pair_distances, queries))
+            queries, candidates, pair_distances = queries[order], candidates[order], pair_distances[order]
+            ranks = np.arange(len(queries)) - np.searchsorted(queries, queries)
+            nearest = ranks < k
+            positions[queries[nearest], ranks[nearest]] = candidates[nearest]
+            distances[queries[nearest], ranks[nearest]] = pair_distances[nearest]
+
+            # Points outside the box are at least `radius` cells away, so closer k-th points are final
+            box_km = np.radians(radius * self.cell_size) * EARTH_RADIUS_KM * np.cos(
+                np.radians(np.minimum(np.abs(latitudes[pending]) + radius * self.cell_size, 90.0)))
+            whole_grid = ((rows[pending] - radius <= 0) & (rows[pending] + radius >= self.n_rows - 1) &
+                          (cols[pending] - radius <= 0) & (cols[pending] + radius >= self.n_cols - 1))
+            pending = pending[~whole_grid & ~(distances[pending, k - 1] <= box_km)]
+            radius *= 2
+        return positions, distances
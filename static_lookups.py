@@ -0,0 +1,66 @@
+"""
+Lookup tables for the map popups, published as static JSON files.
+
+Popup and tooltip details that do not change with the filters (pincode city,
+state and coordinates, hospital address and phone, ...) are written once per
+dataset to static/lookups/<name>-<version>.json and fetched once by the
+browser, instead of being repeated in the properties of every marker each
+time the layers are sent. Columns with repeated values are stored as codes
+into a label list, so the file holds every distinct city or state only once.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Served by Streamlit from the static/ folder next to the dashboards
+LOOKUP_DIR = Path(__file__).with_name('static') / 'lookups'
+LOOKUP_URL = '/app/static/lookups'
+
+
+def lookup_table(keys, columns):
+    """
+    JSON-ready table of `{name: column}` values per key: `rows` maps each key
+    to one value (or label code) per field, `labels` holds the label list of
+    coded fields and null for fields stored as plain values.
+    """
+    fields, labels, values = [], [], []
+    for name, column in columns.items():
+        # A copy, as astype(str) can write into object columns of the shared cached frames
+        text = pd.Series(column, copy=True).astype(str)
+        codes, uniques = pd.factorize(text, sort=True)
+        fields.append(name)
+        if len(uniques) * 2 <= len(codes):
+            labels.append(uniques.tolist())
+            values.append(codes.tolist())
+        else:
+            labels.append(None)
+            values.append(text.tolist())
+
+    keys = np.asarray(keys).astype(str).tolist()
+    return {'fields': fields, 'labels': labels, 'rows': dict(zip(keys, map(list, zip(*values))))}
+
+
+def publish_lookup(name, keys, columns, lookup_dir=LOOKUP_DIR):
+    """Write the lookup table of `name` (unless the same table exists) and return its URL"""
+    text = json.dumps(lookup_table(keys, columns), separators=(',', ':'))
+    version = hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+    file_name = f"{name}-{version}.json"
+    path = Path(lookup_dir) / file_name
+
+    if not path.exists():
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+            tmp_path.write_text(text, encoding='utf-8')
+            os.replace(tmp_path, path)
+            for stale in Path(lookup_dir).glob(f"{name}-*.json"):
+                if stale != path and stale.name.rsplit('-', 1)[0] == name:
+                    stale.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"⚠️  Could not write lookup table {path}: {e}")
+    return f"{LOOKUP_URL}/{file_name}"
@@ -1,9 +1,35 @@
+import html
+import time
+
 import streamlit as st
 import pandas as pd
+import numpy as np
 import folium
-from folium.plugins import MarkerCluster, HeatMap
 from streamlit_folium import st_folium
 
+from pincode_cube import PincodeCube, summarize_type_matrix
+from heat_layer import WEIGHTINGS, heat_points
+from heat_tiles import render_heat_tiles, tile_url
+from hex_bins import hex_bins, hex_rings
+from map_cache import MarkerBudget, RenderedMapCache
+from map_layers import (CachedHeatMap, ClusterMarkerLayer, DynamicLayerAssets, FeatureMarkerLayer,
+                        FeaturePolygonLayer, band_colors, cluster_icon_properties, deserialize_overlays,
+                        feature_collection, format_coordinates, format_percentages, multipolygon_collection,
+                        polygon_collection, serialize_overlays, viewport_bounds)
+from pincode_boundaries import BOUNDARY_FILE, load_pincode_boundaries
+from pincode_clusters import GridClusters, detail_split, tail_clusters
+from pincode_data import PINCODE_COORDS_FILE, SURGERY_FILE, load_surgery_data, load_surgery_pincodes
+from row_index import RowIndex
+from spatial_index import GridIndex
+from snapshot_cache import CACHE_DIR
+from static_lookups import publish_lookup
+from time_series import MonthlySeries
+
+HOSPITALS_FILE = 'eye_hospitals_bangalore_comprehensive.csv'
+
+# Competing hospitals listed in the pincode popups
+NEAREST_HOSPITALS = 3
+
 # Page config
 st.set_page_config(
     page_title="Surgery Type Heatmap Dashboard",
@@ -12,71 +38,123 @@ st.set_page_config(
 )
 
 # Cache data loading
-@st.cache_data
+# Resources rather than cache_data: sessions share the memory-mapped frames instead of unpickling
+# a copy on every run, so the frames and everything built from them are treated as read-only
+@st.cache_resource
 def load_data():
-    """Load and prepare the surgery data"""
-    # Load the surgery data
-    surgery_df = pd.read_csv('BlrSurgeryOnly.csv')
-
-    # Load Google Maps pincode coordinates
-    pincode_coords = pd.read_csv('pincode_coordinates_google.csv')
-
-    # Clean pincodes
-    surgery_df['CPA_PIN_CODE'] = pd.to_numeric(surgery_df['CPA_PIN_CODE'], errors='coerce')
-    surgery_df = surgery_df.dropna(subset=['CPA_PIN_CODE'])
-
-    # Parse registration date to extract year
-    surgery_df['RegistrationDate'] = pd.to_datetime(surgery_df['RegistrationDate'], format='%d/%m/%y', errors='coerce')
-    surgery_df['Year'] = surgery_df['RegistrationDate'].dt.year
-
-    # Clean patient type - handle variations
-    surgery_df['BSM_MINOR_CD'] = surgery_df['BSM_MINOR_CD'].fillna('Unknown').astype(str).str.strip()
-
-    # Merge with Google Maps coordinates
-    merged_df = surgery_df.merge(
-        pincode_coords[['pincode', 'latitude', 'longitude', 'city', 'state']],
-        left_on='CPA_PIN_CODE',
-        right_on='pincode',
-        how='left'
-    )
+    """Load and prepare the surgery data (memory-mapped from the columnar snapshot when the CSVs are unchanged)"""
+    return load_surgery_data()
 
-    # Rename columns to match expected format
-    merged_df = merged_df.rename(columns={
-        'latitude': 'Latitude',
-        'longitude': 'Longitude',
-        'state': 'StateName'
-    })
+@st.cache_resource
+def load_cube():
+    """Pincode x year x patient-type count cube, built once per data load"""
+    return PincodeCube(load_data(), type_column='BSM_MINOR_CD')
 
-    # Use Google Maps city if available, otherwise fall back to address city
-    merged_df['CPA_ADDR_CITY'] = merged_df['city'].fillna(merged_df['CPA_ADDR_CITY'])
+@st.cache_resource
+def load_row_index():
+    """Row positions per pincode, year and patient type plus the date index, shared by every session without copies"""
+    return RowIndex(load_data(), ['CPA_PIN_CODE', 'Year', 'BSM_MINOR_CD'], date_column='RegistrationDate')
 
-    # Drop rows without coordinates
-    merged_df = merged_df.dropna(subset=['Latitude', 'Longitude'])
+@st.cache_resource
+def load_monthly_series():
+    """Pincode x month registration counts for the trend view, built once per data load"""
+    return MonthlySeries(load_data(), type_column='BSM_MINOR_CD')
 
-    return merged_df
+@st.cache_resource
+def load_pincode_locations():
+    """Pincode dimension table: location, city and state per pincode (shared by all sessions, read-only)"""
+    return load_surgery_pincodes()
 
 @st.cache_data
 def load_hospitals():
     """Load eye hospitals data"""
     try:
-        hospitals_df = pd.read_csv('eye_hospitals_bangalore_comprehensive.csv')
+        hospitals_df = pd.read_csv(HOSPITALS_FILE)
         hospitals_df = hospitals_df.dropna(subset=['latitude', 'longitude'])
         return hospitals_df
     except FileNotFoundError:
         return pd.DataFrame()  # Return empty dataframe if file not found
 
+@st.cache_resource
+def load_pincode_index():
+    """Grid index over the pincode locations for viewport queries"""
+    pincode_locations = load_pincode_locations()
+    return GridIndex(pincode_locations['Latitude'], pincode_locations['Longitude'])
+
+@st.cache_resource
+def load_hospital_index():
+    """Grid index over the hospital locations for viewport and nearest-hospital queries"""
+    hospitals = load_hospitals()
+    if hospitals.empty:
+        return GridIndex([], [])
+    return GridIndex(hospitals['latitude'], hospitals['longitude'])
+
+@st.cache_resource
+def load_pincode_details():
+    """URL of the popup lookup table with the city, state and coordinates of every pincode"""
+    pincode_locations = load_pincode_locations()
+    # The popup template inserts these values as HTML, so the city and state names are escaped
+    return publish_lookup('surgery-pincodes', pincode_locations['CPA_PIN_CODE'].astype(int), {
+        'city': pincode_locations['CPA_ADDR_CITY'].astype(str).map(html.escape),
+        'state': pincode_locations['StateName'].astype(str).map(html.escape),
+        'coordinates': format_coordinates(pincode_locations['Latitude'], pincode_locations['Longitude']),
+    })
+
+@st.cache_resource
+def load_hospital_details():
+    """URL of the popup lookup table with the details of every hospital, by row label"""
+    hospitals = load_hospitals()
+    ratings = hospitals['rating']
+
+    # The popup template inserts these values as HTML, so the scraped text is escaped here
+    def escaped(column):
+        return column.astype(str).map(html.escape)
+
+    # Website link only where the hospital has one
+    has_website = hospitals['website'].notna() & (hospitals['website'] != 'N/A')
+    websites = escaped(hospitals['website'].where(has_website, ''))
+    website_html = ('<b>Website:</b> <a href="' + websites + '" target="_blank">Visit</a><br>').where(has_website, '')
+
+    return publish_lookup('hospitals', hospitals.index, {
+        'name': escaped(hospitals['name']),
+        'rating': ratings.astype(str),
+        'reviews': hospitals['review_count'].map('{:,}'.format),
+        'address': escaped(hospitals['address']),
+        'phone': escaped(hospitals['phone']),
+        'website_html': website_html,
+    })
+
+@st.cache_resource
+def load_boundaries():
+    """Pincode boundary polygons simplified per zoom tier, or None without the boundary file"""
+    return load_pincode_boundaries()
+
+@st.cache_resource
+def load_marker_budget():
+    """Individual marker count that keeps a map build within half a second, learnt across sessions"""
+    return MarkerBudget(seconds=0.5)
+
+@st.cache_resource
+def load_map_cache():
+    """Rendered map layers per filter state, shared by every session"""
+    return RenderedMapCache([SURGERY_FILE, PINCODE_COORDS_FILE, HOSPITALS_FILE, BOUNDARY_FILE, __file__],
+                            spill_dir=CACHE_DIR / 'maps')
+
 # Load data
 st.title("🏥 Surgery Type Distribution Heatmap Dashboard")
 st.markdown("Interactive visualization of surgical patients across Bangalore by patient type")
 
 with st.spinner("Loading data..."):
-    df = load_data()
+    row_index = load_row_index()
+    cube = load_cube()
+    monthly_series = load_monthly_series()
+    pincode_locations = load_pincode_locations()
 
 # Sidebar filters
 st.sidebar.header("🔍 Filters")
 
 # Get unique patient types and create user-friendly labels
-patient_types = sorted(df['BSM_MINOR_CD'].unique())
+patient_types = list(row_index.labels['BSM_MINOR_CD'])
 patient_type_labels = {
     '0': '📋 OPD (Outpatient)',
     'CAT': '🏥 CATLAC Surgery',
@@ -86,6 +164,16 @@ patient_type_labels = {
     'Unknown': '❓ Unknown'
 }
 
+# Short patient type names for the per-pincode mix in popups, tooltips and tables
+patient_type_short = {
+    '0': 'OPD',
+    'CAT': 'CAT',
+    'LSK': 'LSK',
+    'IP Others': 'IP Others',
+    'LRC': 'LRC',
+    'Unknown': 'Unknown'
+}
+
 # Create patient type filter
 patient_type_options = ['All Patient Types'] + patient_types
 selected_patient_type = st.sidebar.selectbox(
@@ -95,22 +183,95 @@ selected_patient_type = st.sidebar.selectbox(
 )
 
 # Year filter
-years = sorted(df['Year'].dropna().unique())
+years = row_index.labels['Year']
 year_options = ['All Years'] + [int(year) for year in years]
 selected_year = st.sidebar.selectbox("Select Year", year_options)
 
+# Registration date window (answered from the date-sorted rows)
+date_range = None  # Half-open [start, stop) window on RegistrationDate
+date_bounds = row_index.date_bounds()
+# Extracts without any parseable registration date get no date selector
+if date_bounds is not None:
+    first_date, last_date = date_bounds
+    date_window = st.sidebar.selectbox(
+        "Registration Date Window",
+        ["All Dates", "Last 90 Days", "Quarter", "Custom Range"]
+    )
+    if date_window == "Last 90 Days":
+        # Relative to the latest registration in the extract, not today
+        date_range = (last_date - pd.Timedelta(days=89), last_date + pd.Timedelta(days=1))
+    elif date_window == "Quarter":
+        quarters = pd.period_range(first_date, last_date, freq='Q')[::-1]
+        selected_quarter = st.sidebar.selectbox("Select Quarter", list(quarters), format_func=lambda q: f"{q.year} Q{q.quarter}")
+        date_range = (selected_quarter.start_time, (selected_quarter + 1).start_time)
+    elif date_window == "Custom Range":
+        start_date, end_date = st.sidebar.slider(
+            "Registration Dates",
+            min_value=first_date.date(),
+            max_value=last_date.date(),
+            value=(first_date.date(), last_date.date()),
+            format="DD/MM/YY"
+        )
+        date_range = (pd.Timestamp(start_date), pd.Timestamp(end_date) + pd.Timedelta(days=1))
+
 # Visualization type
+viz_options = ["Clustered Markers", "Heatmap", "Both", "Hex Bins"]
+# Pincode areas can only be shaded when the boundary file is available
+if load_boundaries() is not None:
+    viz_options.append("Choropleth")
 viz_type = st.sidebar.radio(
     "Visualization Type",
-    ["Clustered Markers", "Heatmap", "Both"]
+    viz_options
 )
 
+# Hexagon size of the hex bin layer
+hex_cell_km = None
+if viz_type == "Hex Bins":
+    hex_cell_km = st.sidebar.select_slider("Hex Cell Size (km)", options=[1, 2, 5, 10], value=2)
+
 # Display mode toggle
 display_mode = st.sidebar.radio(
     "Display Mode",
     ["Absolute Count", "Percentage"]
 )
 
+# Level of detail: the biggest pincodes keep their own marker, the long tail is aggregated
+marker_detail = None
+if viz_type in ["Clustered Markers", "Both"]:
+    marker_detail = st.sidebar.select_slider(
+        "Individual Pincode Markers",
+        options=['Auto', 100, 250, 500, 1000, 2500, 5000, 'All'],
+        value='Auto',
+        help="Pincodes beyond this many, smallest first, are grouped into long-tail bubbles on a coarser grid; "
+             "Auto picks the most that keep the map build within its time budget"
+    )
+
+# Heatmap drawn from server-rendered tiles instead of blurring every point in the browser
+heat_tiles = viz_type in ["Heatmap", "Both"] and st.sidebar.checkbox(
+    "Pre-rendered Heatmap Tiles",
+    value=False,
+    help="Render the heatmap once on the server as image tiles; lighter for the browser with many pincodes"
+)
+
+# Weight scale of the heatmap points, so that a few very large pincodes do not wash out the rest
+heat_weighting = None
+if viz_type in ["Heatmap", "Both"] and not heat_tiles:
+    heat_weighting = st.sidebar.selectbox(
+        "Heatmap Weighting",
+        WEIGHTINGS,
+        index=WEIGHTINGS.index('log'),
+        format_func=str.title,
+        help="Linear: proportional to the count; Log: compresses the largest pincodes; "
+             "Percentile: by rank among the pincodes"
+    )
+
+# Viewport mode: only send what is inside the visible map area
+viewport_mode = st.sidebar.checkbox(
+    "Render Visible Area Only",
+    value=False,
+    help="Send only the pincodes and hospitals inside the current map view (plus a margin) to the map; panning updates them"
+)
+
 # Load hospitals data early
 hospitals = load_hospitals()
 
@@ -169,39 +330,67 @@ else:
     hospital_min_rating = 4.0
     hospital_min_reviews = 500
 
-# Apply filters
-filtered_df = df.copy()
-
-if selected_patient_type != 'All Patient Types':
-    filtered_df = filtered_df[filtered_df['BSM_MINOR_CD'] == selected_patient_type]
+# Apply filters: a slice of the pre-aggregated cube, or the row index for date windows
+year_filter = None if selected_year == 'All Years' else selected_year
+type_filter = None if selected_patient_type == 'All Patient Types' else selected_patient_type
 
-if selected_year != 'All Years':
-    filtered_df = filtered_df[filtered_df['Year'] == selected_year]
+if date_range is None:
+    type_matrix = cube.type_matrix(year=year_filter, patient_type=type_filter)
+else:
+    positions = row_index.select({'Year': year_filter, 'BSM_MINOR_CD': type_filter}, date_range=date_range)
+    type_matrix = row_index.crosstab(positions, 'CPA_PIN_CODE', 'BSM_MINOR_CD')
 
-# Aggregate data by pincode
-pincode_counts = filtered_df.groupby('CPA_PIN_CODE').size().reset_index(name='patient_count')
+# Aggregate data by pincode, with counts and shares of every patient type
+pincode_summary = summarize_type_matrix(type_matrix, cube.pincodes, cube.types, 'patient_count', with_type_mix=True)
 
-# For each pincode, get representative location and most common city/state
-pincode_locations = filtered_df.groupby('CPA_PIN_CODE').agg({
-    'Latitude': 'median',
-    'Longitude': 'median',
-    'CPA_ADDR_CITY': lambda x: x.mode()[0] if len(x.mode()) > 0 else x.iloc[0],
-    'StateName': lambda x: x.mode()[0] if len(x.mode()) > 0 else x.iloc[0],
-    'BSM_MINOR_CD': lambda x: x.mode()[0] if len(x.mode()) > 0 else x.iloc[0]  # Get the patient type
-}).reset_index()
+# Readable patient mix per pincode (e.g. "OPD 62% · CAT 25%"), built one patient type at a time
+type_mix = pd.Series('', index=pincode_summary.index)
+for patient_type in cube.types:
+    has_type = pincode_summary[f'{patient_type}_count'] > 0
+    share_text = pincode_summary[f'{patient_type}_share'].round().astype(int).astype(str)
+    part = (patient_type_short.get(patient_type, patient_type) + ' ' + share_text + '%').where(has_type, '')
+    separator = pd.Series(np.where((type_mix != '') & has_type, ' · ', ''), index=type_mix.index)
+    type_mix = type_mix + separator + part
+pincode_summary['type_mix'] = type_mix
 
-# Merge counts with locations
-pincode_summary = pincode_counts.merge(pincode_locations, on='CPA_PIN_CODE')
+# Join location, city and state from the pincode dimension table
+pincode_summary = pincode_summary.merge(pincode_locations, on='CPA_PIN_CODE', how='left')
 
 # Calculate percentage of total patients
-total_patients = len(filtered_df)
+total_patients = int(pincode_summary['patient_count'].sum())
 pincode_summary['percentage'] = (pincode_summary['patient_count'] / total_patients * 100)
 pincode_summary = pincode_summary.sort_values('patient_count', ascending=False)
 
+# Nearest competing hospitals of every pincode, among the hospitals that pass the filters;
+# the hospital index is built once, so moving the sliders only changes the search mask
+nearest_popup = ""
+if show_hospitals:
+    competitors = (
+        (hospitals['rating'] >= hospital_min_rating) &
+        (hospitals['review_count'] >= hospital_min_reviews) &
+        ~hospitals['name'].isin(st.session_state.excluded_hospitals)
+    ).to_numpy()
+    nearest_positions, nearest_km = load_hospital_index().nearest(
+        pincode_summary['Latitude'], pincode_summary['Longitude'], k=NEAREST_HOSPITALS, mask=competitors
+    )
+    pincode_summary['nearest_hospital_km'] = np.where(np.isfinite(nearest_km[:, 0]), nearest_km[:, 0], np.nan)
+
+    # Popup list of the nearest hospitals (e.g. "Eye Care (1.2 km)"), built one rank at a time
+    hospital_names = hospitals['name'].astype(str).map(html.escape).to_numpy()
+    nearest_hospitals = pd.Series('', index=pincode_summary.index)
+    for rank in range(NEAREST_HOSPITALS):
+        found = np.isfinite(nearest_km[:, rank])
+        names = pd.Series(hospital_names[np.where(found, nearest_positions[:, rank], 0)], index=pincode_summary.index)
+        entry = names + ' (' + np.char.mod('%.1f', nearest_km[:, rank]) + ' km)'
+        separator = '<br>' if rank else ''
+        nearest_hospitals = nearest_hospitals + (separator + entry).where(found, '')
+    pincode_summary['nearest_hospitals'] = nearest_hospitals.where(nearest_hospitals != '', 'None matching the filters')
+    nearest_popup = '<hr style="margin: 5px 0;"><b>Nearest Hospitals:</b><br>{nearest_hospitals}'
+
 # Display statistics
 col1, col2, col3, col4 = st.columns(4)
 with col1:
-    st.metric("Total Patients", f"{len(filtered_df):,}")
+    st.metric("Total Patients", f"{total_patients:,}")
 with col2:
     st.metric("Unique Pincodes", f"{len(pincode_summary):,}")
 with col3:
@@ -212,8 +401,8 @@ with col4:
 # Display patient type breakdown if showing all types
 if selected_patient_type == 'All Patient Types':
     st.subheader("📊 Patient Type Breakdown")
-    type_breakdown = df.groupby('BSM_MINOR_CD').size().reset_index(name='count')
-    type_breakdown['percentage'] = (type_breakdown['count'] / len(df) * 100).round(1)
+    type_breakdown = pd.DataFrame({'BSM_MINOR_CD': cube.types, 'count': cube.type_matrix().sum(axis=0)})
+    type_breakdown['percentage'] = (type_breakdown['count'] / row_index.n_rows * 100).round(1)
     type_breakdown = type_breakdown.sort_values('count', ascending=False)
 
     # Create columns for breakdown display
@@ -237,13 +426,51 @@ else:
 # Create map
 st.subheader("🗺️ Map Visualization")
 
+# Zoom level the map was left at on the previous run (returned by st_folium)
+map_state = st.session_state.get('patient_map') or {}
+map_zoom = map_state.get('zoom') or 11
+
+# Pincodes drawn on the map: all of them, or those in the visible area
+map_pincodes = pincode_summary
+visible_bounds = viewport_bounds(map_state) if viewport_mode else None
+if visible_bounds is not None:
+    in_view = load_pincode_index().query(*visible_bounds)
+    map_pincodes = pincode_summary[pincode_summary['CPA_PIN_CODE'].isin(pincode_locations['CPA_PIN_CODE'].to_numpy()[in_view])]
+    st.caption(f"Rendering {len(map_pincodes):,} of {len(pincode_summary):,} pincodes in the visible area")
+
+# Pincodes without a boundary polygon cannot be shaded on the choropleth
+if viz_type == "Choropleth":
+    n_unshaded = int((~load_boundaries().contains(map_pincodes['CPA_PIN_CODE'], map_zoom)).sum())
+    if n_unshaded:
+        st.caption(f"{n_unshaded:,} of {len(map_pincodes):,} pincodes have no boundary polygon and are not shaded")
+
+# Individual markers for the top of the count-sorted pincodes, up to the marker limit
+marker_limit = None
+n_detailed = len(map_pincodes)
+if marker_detail is not None:
+    if marker_detail == 'Auto':
+        marker_limit = load_marker_budget().max_markers([100, 250, 500, 1000, 2500, 5000])
+    elif marker_detail != 'All':
+        marker_limit = marker_detail
+    n_detailed = detail_split(map_pincodes['patient_count'], marker_limit)
+    if n_detailed < len(map_pincodes):
+        st.caption(f"Showing the top {n_detailed:,} pincodes (more than "
+                   f"{map_pincodes['patient_count'].iloc[n_detailed]:,} patients) individually; "
+                   f"the other {len(map_pincodes) - n_detailed:,} are grouped into dashed long-tail bubbles")
+
+# The base map is built from the same arguments on every rerun, so streamlit-folium keeps
+# the mounted map and only swaps the dynamic layers; later filter changes move the view instead
+if 'patient_map_center' not in st.session_state:
+    st.session_state['patient_map_center'] = [float(center_lat), float(center_lon)]
+
 # Create base map
 m = folium.Map(
-    location=[center_lat, center_lon],
+    location=st.session_state['patient_map_center'],
     zoom_start=11,
     tiles='OpenStreetMap',
     control_scale=True
 )
+DynamicLayerAssets().add_to(m)
 
 # Define colors for patient types
 type_colors = {
@@ -255,245 +482,372 @@ type_colors = {
     'Unknown': '#7f7f7f'   # Gray for Unknown
 }
 
-# Add markers with clustering
-if viz_type in ["Clustered Markers", "Both"]:
+# Heatmap tiles are rendered once per filter combination and then served as static files
+heat_tile_version = None
+if heat_tiles:
+    with st.spinner("Rendering heatmap tiles..."):
+        heat_tile_version = render_heat_tiles(pincode_summary['Latitude'], pincode_summary['Longitude'],
+                                              pincode_summary['patient_count'], min_zoom=8, max_zoom=13)
+
+# The layers only depend on the filters, so another run may already have rendered them
+map_cache = load_map_cache()
+overlay_key = map_cache.key(
+    patient_type=selected_patient_type,
+    year=selected_year,
+    date_range=date_range,
+    viz_type=viz_type,
+    display_mode=display_mode,
+    # Only the clusters depend on the zoom
+    zoom=int(round(map_zoom)) if viz_type in ["Clustered Markers", "Both"] else None,
+    hex_cell_km=hex_cell_km,
+    # Boundaries are simplified per zoom tier, so the choropleth only changes between tiers
+    boundary_tier=load_boundaries().tier(map_zoom) if viz_type == "Choropleth" else None,
+    marker_limit=marker_limit,
+    bounds=visible_bounds,
+    hospitals=(hospital_min_rating, hospital_min_reviews, st.session_state.excluded_hospitals) if show_hospitals else None,
+    heat_tiles=heat_tile_version,
+    heat_weighting=heat_weighting
+)
+rendered_overlays = map_cache.get(overlay_key)
+build_overlays = rendered_overlays is None
+
+# Add markers, clustered on the server for the current zoom level
+overlays = []
+if build_overlays and viz_type in ["Clustered Markers", "Both"]:
     is_percentage_mode = display_mode == "Percentage"
 
-    # Custom cluster function
-    if is_percentage_mode:
-        icon_create_function = f"""
-        function(cluster) {{
-            var markers = cluster.getAllChildMarkers();
-            var sumCount = 0;
-            var sumPct = 0;
-            var totalPatients = {total_patients};
-            for (var i = 0; i < markers.length; i++) {{
-                if (markers[i].options.customCount) {{
-                    sumCount += markers[i].options.customCount;
-                }}
-                if (markers[i].options.customPercentage) {{
-                    sumPct += markers[i].options.customPercentage;
-                }}
-            }}
-
-            var displayText = sumPct < 1 ? '<1%' : sumPct.toFixed(1) + '%';
-
-            var size = 'small';
-            if (sumPct >= 10) size = 'large';
-            else if (sumPct >= 5) size = 'medium';
-
-            var color = 'lightblue';
-            if (sumPct >= 10) color = 'red';
-            else if (sumPct >= 5) color = 'orange';
-            else if (sumPct >= 1) color = 'lightgreen';
-
-            return L.divIcon({{
-                html: '<div style="background-color:' + color + '; border-radius: 50%; text-align: center; color: black; font-weight: bold; border: 3px solid white; box-shadow: 0 0 10px rgba(0,0,0,0.5);"><span>' + displayText + '</span></div>',
-                className: 'marker-cluster marker-cluster-' + size,
-                iconSize: new L.Point(40, 40)
-            }});
-        }}
-        """
-    else:
-        icon_create_function = """
-        function(cluster) {
-            var markers = cluster.getAllChildMarkers();
-            var sum = 0;
-            for (var i = 0; i < markers.length; i++) {
-                if (markers[i].options.customCount) {
-                    sum += markers[i].options.customCount;
-                }
-            }
-            var size = 'small';
-            if (sum >= 5000) size = 'large';
-            else if (sum >= 1000) size = 'medium';
-
-            var color = 'lightblue';
-            if (sum > 1000) color = 'red';
-            else if (sum > 500) color = 'orange';
-            else if (sum >= 100) color = 'lightgreen';
-
-            return L.divIcon({
-                html: '<div style="background-color:' + color + '; border-radius: 50%; text-align: center; color: black; font-weight: bold; border: 3px solid white; box-shadow: 0 0 10px rgba(0,0,0,0.5);"><span>' + sum + '</span></div>',
-                className: 'marker-cluster marker-cluster-' + size,
-                iconSize: new L.Point(40, 40)
-            });
-        }
-        """
-
-    marker_cluster = MarkerCluster(
-        name="Patient Locations",
-        overlay=True,
-        control=True,
-        icon_create_function=icon_create_function
-    )
+    build_start = time.perf_counter()
+    detailed_pincodes = map_pincodes.iloc[:n_detailed]
+    tail_pincodes = map_pincodes.iloc[n_detailed:]
+
+    # Group nearby pincodes on a grid for the current zoom; only this level is sent to the map
+    clusters = GridClusters(detailed_pincodes['Latitude'], detailed_pincodes['Longitude'],
+                            detailed_pincodes['patient_count'], total=total_patients)
+    level = clusters.level(map_zoom)
+    grouped = level[level['n_points'] > 1]
+
+    # Pincodes that are on their own at this zoom keep their individual marker
+    single_pincodes = detailed_pincodes.iloc[level.loc[level['n_points'] == 1, 'point'].to_numpy()]
 
-    for idx, row in pincode_summary.iterrows():
-        pct_display = "<1%" if row['percentage'] < 1 else f"{row['percentage']:.1f}%"
+    # Marker label and colour for every pincode at once
+    counts = single_pincodes['patient_count'].to_numpy()
+    percentages = single_pincodes['percentage'].to_numpy()
+    pct_display = format_percentages(percentages)
 
-        # Get patient type from the row
-        patient_type = row['BSM_MINOR_CD']
-        patient_label = patient_type_labels.get(patient_type, patient_type)
+    # Patient mix is only informative when all patient types are shown
+    mix_suffix = " · {type_mix}" if type_filter is None else ""
 
-        popup_html = f"""
+    if is_percentage_mode:
+        labels = pct_display
+        colors = band_colors(percentages, (10, 5, 1))
+        tooltip_template = "{city} - {pct_display} ({count} patients)" + mix_suffix
+    else:
+        labels = counts.astype(str)
+        colors = band_colors(counts, (1000, 500, 100), inclusive=False)
+        tooltip_template = "{city} - {count} patients" + mix_suffix
+
+    popup_template = """
         <div style="font-family: Arial; width: 220px;">
-            <h4 style="margin: 0; color: #1f77b4;">📍 {row['CPA_ADDR_CITY']}</h4>
+            <h4 style="margin: 0; color: #1f77b4;">📍 {city}</h4>
             <hr style="margin: 5px 0;">
-            <b>Patient Type:</b> {patient_label}<br>
-            <b>Pincode:</b> {int(row['CPA_PIN_CODE'])}<br>
-            <b>State:</b> {row['StateName']}<br>
-            <b>Patients:</b> <span style="color: #d62728; font-weight: bold;">{row['patient_count']}</span><br>
+            <b>Patient Mix:</b> {type_mix}<br>
+            <b>Pincode:</b> {pincode}<br>
+            <b>State:</b> {state}<br>
+            <b>Patients:</b> <span style="color: #d62728; font-weight: bold;">{count}</span><br>
             <b>Percentage:</b> <span style="color: #d62728; font-weight: bold;">{pct_display}</span><br>
-            <b>Coordinates:</b> {row['Latitude']:.4f}, {row['Longitude']:.4f}
+            <b>Coordinates:</b> {coordinates}
+            """ + nearest_popup + """
         </div>
-        """
-
-        if is_percentage_mode:
-            display_text = pct_display
-            if row['percentage'] >= 10:
-                color = 'red'
-            elif row['percentage'] >= 5:
-                color = 'orange'
-            elif row['percentage'] >= 1:
-                color = 'lightgreen'
-            else:
-                color = 'lightblue'
-            tooltip_text = f"{row['CPA_ADDR_CITY']} - {pct_display} ({row['patient_count']} patients)"
-        else:
-            display_text = str(row['patient_count'])
-            if row['patient_count'] > 1000:
-                color = 'red'
-            elif row['patient_count'] > 500:
-                color = 'orange'
-            elif row['patient_count'] > 100:
-                color = 'lightgreen'
-            else:
-                color = 'lightblue'
-            tooltip_text = f"{row['CPA_ADDR_CITY']} - {row['patient_count']} patients"
-
-        custom_icon = folium.DivIcon(
-            html=f'''
-            <div style="
-                background-color: {color};
-                border-radius: 50%;
-                width: 35px;
-                height: 35px;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-                color: black;
-                font-weight: bold;
-                font-size: 11px;
-                border: 3px solid white;
-                box-shadow: 0 0 10px rgba(0,0,0,0.5);
-            ">{display_text}</div>
-            '''
-        )
-
-        marker = folium.Marker(
-            location=[row['Latitude'], row['Longitude']],
-            popup=folium.Popup(popup_html, max_width=250),
-            tooltip=tooltip_text,
-            icon=custom_icon
-        )
-        marker.options['customCount'] = int(row['patient_count'])
-        marker.options['customPercentage'] = float(row['percentage'])
-        marker.add_to(marker_cluster)
-
-    marker_cluster.add_to(m)
+    """
+
+    icon_template = """
+        <div style="
+            background-color: {color};
+            border-radius: 50%;
+            width: 35px;
+            height: 35px;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            color: black;
+            font-weight: bold;
+            font-size: 11px;
+            border: 3px solid white;
+            box-shadow: 0 0 10px rgba(0,0,0,0.5);
+        ">{label}</div>
+    """
+
+    marker_group = folium.FeatureGroup(name="Patient Locations")
+
+    # One GeoJSON layer for the individual pincodes; city, state and coordinates come from the lookup table
+    marker_properties = {
+        'pincode': single_pincodes['CPA_PIN_CODE'].astype(int),
+        'count': counts,
+        'pct_display': pct_display,
+        'type_mix': single_pincodes['type_mix'],
+        'label': labels,
+        'color': colors,
+    }
+    if show_hospitals:
+        marker_properties['nearest_hospitals'] = single_pincodes['nearest_hospitals']
+    marker_data = feature_collection(single_pincodes['Latitude'], single_pincodes['Longitude'], marker_properties)
+    FeatureMarkerLayer(
+        marker_data,
+        icon_template=icon_template,
+        tooltip_template=tooltip_template,
+        popup_template=popup_template,
+        lookup_url=load_pincode_details(),
+        lookup_key='pincode',
+        control=False
+    ).add_to(marker_group)
+
+    # Cluster bubbles show the patient sum (or share) of their pincodes; click to zoom in
+    cluster_labels, cluster_colors, cluster_sizes = cluster_icon_properties(
+        grouped['count'], grouped['percentage'], is_percentage_mode
+    )
+    cluster_data = feature_collection(grouped['Latitude'], grouped['Longitude'], {
+        'count': grouped['count'],
+        'pct_display': format_percentages(grouped['percentage']),
+        'n_points': grouped['n_points'],
+        'label': cluster_labels,
+        'color': cluster_colors,
+        'size': cluster_sizes,
+        'south': grouped['south'],
+        'west': grouped['west'],
+        'north': grouped['north'],
+        'east': grouped['east'],
+    })
+    ClusterMarkerLayer(
+        cluster_data,
+        icon_template='<div style="background-color:{color}; border-radius: 50%; text-align: center; color: black; font-weight: bold; border: 3px solid white; box-shadow: 0 0 10px rgba(0,0,0,0.5);"><span>{label}</span></div>',
+        tooltip_template="{n_points} pincodes - {count} patients ({pct_display})",
+        icon_class="marker-cluster marker-cluster-{size}",
+        icon_size=(40, 40),
+        zoom_to_bounds=True,
+        control=False
+    ).add_to(marker_group)
+
+    # Long tail of small pincodes: one dashed bubble per cell of a coarser grid; click to zoom in
+    tail = tail_clusters(tail_pincodes['Latitude'], tail_pincodes['Longitude'], tail_pincodes['patient_count'],
+                         map_zoom, total=total_patients)
+    tail_labels, tail_colors, _ = cluster_icon_properties(tail['count'], tail['percentage'], is_percentage_mode)
+    tail_data = feature_collection(tail['Latitude'], tail['Longitude'], {
+        'count': tail['count'],
+        'pct_display': format_percentages(tail['percentage']),
+        'n_points': tail['n_points'],
+        'label': tail_labels,
+        'color': tail_colors,
+        'south': tail['south'],
+        'west': tail['west'],
+        'north': tail['north'],
+        'east': tail['east'],
+    })
+    FeatureMarkerLayer(
+        tail_data,
+        icon_template='<div style="background-color:{color}; opacity: 0.7; border-radius: 50%; width: 30px; height: 30px; line-height: 24px; text-align: center; color: black; font-size: 10px; border: 3px dashed white; box-sizing: border-box;">{label}</div>',
+        tooltip_template="{n_points} smaller pincodes - {count} patients ({pct_display})",
+        icon_size=(30, 30),
+        zoom_to_bounds=True,
+        control=False
+    ).add_to(marker_group)
+    n_markers = len(level) + len(tail)
+
+    # Sent as a dynamic layer so zooming only replaces the markers, not the whole map
+    overlays.append(marker_group)
 
 # Add heatmap layer
-if viz_type in ["Heatmap", "Both"]:
-    heat_data = [
-        [row['Latitude'], row['Longitude'], row['patient_count']]
-        for _, row in pincode_summary.iterrows()
-    ]
-
-    HeatMap(
-        heat_data,
-        name="Heatmap",
-        min_opacity=0.3,
-        max_zoom=18,
-        radius=15,
-        blur=20,
-        gradient={
-            0.0: 'blue',
-            0.5: 'lime',
-            0.7: 'yellow',
-            1.0: 'red'
-        }
-    ).add_to(m)
+if build_overlays and viz_type in ["Heatmap", "Both"]:
+    heat_group = folium.FeatureGroup(name="Heatmap")
+    if heat_tile_version is not None:
+        # The browser only loads the tile images of the visible area; deeper zooms scale up the last level
+        folium.TileLayer(
+            tiles=tile_url(heat_tile_version),
+            attr='Pincode heatmap',
+            max_native_zoom=13,
+            min_native_zoom=8,
+            control=False
+        ).add_to(heat_group)
+    else:
+        # Coincident pincodes merged and weights normalized to 0-1 in one vectorized pass
+        # The weighting selector is hidden while tiles are on, so a failed tile render uses its default
+        heat_data = heat_points(map_pincodes['Latitude'], map_pincodes['Longitude'], map_pincodes['patient_count'],
+                                weighting=heat_weighting or 'log')
+
+        CachedHeatMap(
+            heat_data,
+            min_opacity=0.3,
+            # Normalized weights reach full intensity from the opening zoom level
+            max_zoom=11,
+            radius=15,
+            blur=20,
+            gradient={
+                0.0: 'blue',
+                0.5: 'lime',
+                0.7: 'yellow',
+                1.0: 'red'
+            }
+        ).add_to(heat_group)
+    overlays.append(heat_group)
+
+# Add hexagon bins: patients per hexagon, an even spatial unit unlike the pincode areas
+if build_overlays and viz_type == "Hex Bins":
+    # Cells are {hex_cell_km} km across at the latitude of Bangalore
+    bins = hex_bins(map_pincodes['Latitude'], map_pincodes['Longitude'], map_pincodes['patient_count'],
+                    hex_cell_km, reference_latitude=12.9716, total=total_patients)
+    if display_mode == "Percentage":
+        hex_colors = band_colors(bins['percentage'], (10, 5, 1))
+    else:
+        hex_colors = band_colors(bins['count'], (1000, 500, 100), inclusive=False)
+
+    hex_data = polygon_collection(hex_rings(bins, hex_cell_km, reference_latitude=12.9716), {
+        'count': bins['count'],
+        'pct_display': format_percentages(bins['percentage']),
+        'n_points': bins['n_points'],
+        'color': hex_colors,
+    })
+    hex_group = folium.FeatureGroup(name="Hex Bins")
+    FeaturePolygonLayer(
+        hex_data,
+        style_options={
+            'color': '{color}',
+            'weight': 1,
+            'fillColor': '{color}',
+            'fillOpacity': 0.5,
+        },
+        tooltip_template="{n_points} pincodes - {count} patients ({pct_display})",
+        control=False
+    ).add_to(hex_group)
+    overlays.append(hex_group)
+
+# Add pincode areas shaded by their patients, with boundaries simplified for the current zoom
+if build_overlays and viz_type == "Choropleth":
+    found, boundaries = load_boundaries().geometries(map_pincodes['CPA_PIN_CODE'], map_zoom)
+    shaded_pincodes = map_pincodes[found]
+    counts = shaded_pincodes['patient_count'].to_numpy()
+    percentages = shaded_pincodes['percentage'].to_numpy()
+    if display_mode == "Percentage":
+        area_colors = band_colors(percentages, (10, 5, 1))
+    else:
+        area_colors = band_colors(counts, (1000, 500, 100), inclusive=False)
+
+    # Patient mix is only informative when all patient types are shown
+    mix_suffix = " · {type_mix}" if type_filter is None else ""
+
+    area_properties = {
+        'pincode': shaded_pincodes['CPA_PIN_CODE'].astype(int),
+        'count': counts,
+        'pct_display': format_percentages(percentages),
+        'type_mix': shaded_pincodes['type_mix'],
+        'color': area_colors,
+    }
+    if show_hospitals:
+        area_properties['nearest_hospitals'] = shaded_pincodes['nearest_hospitals']
+    area_data = multipolygon_collection(boundaries, area_properties)
+    area_group = folium.FeatureGroup(name="Pincode Areas")
+    FeaturePolygonLayer(
+        area_data,
+        style_options={
+            'color': '{color}',
+            'weight': 0.5,
+            'fillColor': '{color}',
+            'fillOpacity': 0.6,
+        },
+        tooltip_template="{city} ({pincode}) - {count} patients ({pct_display})" + mix_suffix,
+        popup_template="""
+            <div style="font-family: Arial; width: 220px;">
+                <h4 style="margin: 0; color: #1f77b4;">📍 {city}</h4>
+                <hr style="margin: 5px 0;">
+                <b>Patient Mix:</b> {type_mix}<br>
+                <b>Pincode:</b> {pincode}<br>
+                <b>State:</b> {state}<br>
+                <b>Patients:</b> <span style="color: #d62728; font-weight: bold;">{count}</span><br>
+                <b>Percentage:</b> <span style="color: #d62728; font-weight: bold;">{pct_display}</span>
+                """ + nearest_popup + """
+            </div>
+        """,
+        lookup_url=load_pincode_details(),
+        lookup_key='pincode',
+        control=False
+    ).add_to(area_group)
+    overlays.append(area_group)
 
 # Add hospital markers
-if show_hospitals and not hospitals.empty:
-    # Filter hospitals by rating and review count
-    filtered_hospitals = hospitals[
-        (hospitals['rating'] >= hospital_min_rating) &
-        (hospitals['review_count'] >= hospital_min_reviews)
-    ].copy()
+if build_overlays and show_hospitals and not hospitals.empty:
+    # Hospitals that pass the rating and review filters and were not removed
+    filtered_hospitals = hospitals[competitors]
 
-    # Remove excluded hospitals
-    filtered_hospitals = filtered_hospitals[
-        ~filtered_hospitals['name'].isin(st.session_state.excluded_hospitals)
-    ]
+    # Keep only the hospitals in the visible area in viewport mode
+    if visible_bounds is not None:
+        in_view = hospitals.index[load_hospital_index().query(*visible_bounds)]
+        filtered_hospitals = filtered_hospitals[filtered_hospitals.index.isin(in_view)]
 
     # Create hospital marker group
     hospital_group = folium.FeatureGroup(name='Eye Hospitals', show=True)
 
-    # Define color based on hospital rating
-    def get_hospital_color(rating):
-        """Get marker color based on rating"""
-        if rating >= 4.6:
-            return "darkgreen"  # Excellent
-        elif rating >= 4.4:
-            return "green"  # Very Good
-        elif rating >= 4.2:
-            return "blue"  # Good
-        else:
-            return "orange"  # Fair
-
-    # Add hospital markers
-    for idx, hospital in filtered_hospitals.iterrows():
-        color = get_hospital_color(hospital['rating'])
-
-        # Create popup with hospital info
-        website_html = ''
-        if pd.notna(hospital['website']) and str(hospital['website']) != 'N/A':
-            website_html = f'<b>Website:</b> <a href="{hospital["website"]}" target="_blank">Visit</a><br>'
-
-        popup_text = f"""
+    # Color based on hospital rating: darkgreen (excellent), green (very good), blue (good), orange (fair)
+    ratings = filtered_hospitals['rating']
+    hospital_colors = np.select([ratings >= 4.6, ratings >= 4.4, ratings >= 4.2], ['darkgreen', 'green', 'blue'], 'orange')
+
+    hospital_popup_template = """
         <div style="font-family: Arial; font-size: 12px; width: 260px;">
-            <h4 style="margin: 5px 0; color: {color};">👁️ {hospital['name']}</h4>
+            <h4 style="margin: 5px 0; color: {color};">👁️ {name}</h4>
             <hr style="margin: 3px 0;">
-            <b>Rating:</b> ⭐ {hospital['rating']}/5.0<br>
-            <b>Reviews:</b> {hospital['review_count']:,}<br>
-            <b>Address:</b> {hospital['address']}<br>
-            <b>Phone:</b> {hospital['phone']}<br>
+            <b>Rating:</b> ⭐ {rating}/5.0<br>
+            <b>Reviews:</b> {reviews}<br>
+            <b>Address:</b> {address}<br>
+            <b>Phone:</b> {phone}<br>
             {website_html}
             <hr style="margin: 3px 0;">
         </div>
-        """
+    """
 
-        # Create circular marker
-        folium.CircleMarker(
-            location=[hospital['latitude'], hospital['longitude']],
-            radius=6,
-            popup=folium.Popup(popup_text, max_width=300),
-            color=color,
-            fill=True,
-            fillColor=color,
-            fillOpacity=0.7,
-            weight=2,
-            tooltip=f"👁️ {hospital['name']} ({hospital['rating']} ⭐)"
-        ).add_to(hospital_group)
-
-    hospital_group.add_to(m)
-
-# Add layer control
-folium.LayerControl().add_to(m)
-
-# Display map
-st_folium(m, width=1400, height=600)
+    # One GeoJSON layer of circular markers for all hospitals; the details come from the lookup table
+    hospital_data = feature_collection(filtered_hospitals['latitude'], filtered_hospitals['longitude'], {
+        'id': filtered_hospitals.index,
+        'color': hospital_colors,
+    })
+    FeatureMarkerLayer(
+        hospital_data,
+        tooltip_template="👁️ {name} ({rating} ⭐)",
+        popup_template=hospital_popup_template,
+        popup_max_width=300,
+        lookup_url=load_hospital_details(),
+        lookup_key='id',
+        circle_options={
+            'radius': 6,
+            'color': '{color}',
+            'fill': True,
+            'fillColor': '{color}',
+            'fillOpacity': 0.7,
+            'weight': 2,
+        },
+        control=False
+    ).add_to(hospital_group)
+
+    overlays.append(hospital_group)
+
+if build_overlays:
+    rendered_overlays = serialize_overlays(overlays)
+    map_cache.put(overlay_key, rendered_overlays)
+    if viz_type == "Clustered Markers":
+        # Markers are the only layers then, so the build time calibrates the Auto marker limit
+        load_marker_budget().record(n_markers, time.perf_counter() - build_start)
+
+# Always sent in the serialized form, so a cache hit produces the same script as the run that built it
+overlays = deserialize_overlays(rendered_overlays)
+
+# Display map; zoom changes (and pans in viewport mode) rerun the script to rebuild the dynamic layers
+st_folium(
+    m,
+    width=1400,
+    height=600,
+    key='patient_map',
+    center=[float(center_lat), float(center_lon)],
+    zoom=map_zoom,
+    feature_group_to_add=overlays or None,
+    layer_control=folium.LayerControl(),
+    returned_objects=['zoom', 'bounds'] if viewport_mode else ['zoom']
+)
 
 # Hospital management section
 if show_hospitals and not hospitals.empty:
@@ -565,28 +919,60 @@ if len(pincode_summary) > 0:
     top_locations.columns = ['City', 'Pincode', 'State', 'Patient Count', 'Percentage']
     top_locations['Pincode'] = top_locations['Pincode'].astype(int)
     top_locations['Percentage'] = top_locations['Percentage'].apply(lambda x: "<1%" if x < 1 else f"{x:.1f}%")
+    if show_hospitals:
+        # Distance to the nearest hospital that passes the hospital filters
+        top_locations['Nearest Competitor (km)'] = pincode_summary.head(20)['nearest_hospital_km'].round(1)
+    if type_filter is None:
+        # Share of each patient type within the pincode
+        for patient_type in cube.types:
+            shares = pincode_summary.head(20)[f'{patient_type}_share']
+            top_locations[f"{patient_type_short.get(patient_type, patient_type)} %"] = shares.map(lambda x: f"{x:.0f}%")
     top_locations.index = range(1, len(top_locations) + 1)
     st.dataframe(top_locations, width='stretch')
 else:
     st.info("No data available for the selected filters.")
 
+# Demand trends over every pincode at once
+st.subheader("📈 Fastest Growing Pincodes")
+st.caption("Least-squares trend of monthly registrations over the last 12 complete months (ignores the year and date filters)")
+growth = monthly_series.growth_table(patient_type=type_filter, window=12, min_monthly_avg=1.0)
+if len(growth) > 0:
+    top_growth = growth.head(20).merge(pincode_locations, on='CPA_PIN_CODE', how='left')
+    growth_table = top_growth[['CPA_ADDR_CITY', 'CPA_PIN_CODE', 'recent_avg', 'trend_per_month', 'trend_pct', 'yoy_growth']].copy()
+    growth_table.columns = ['City', 'Pincode', 'Patients / Month (last 3)', 'Trend / Month', 'Trend %', 'YoY Growth']
+    growth_table['Pincode'] = growth_table['Pincode'].astype(int)
+    growth_table['Patients / Month (last 3)'] = growth_table['Patients / Month (last 3)'].round(1)
+    growth_table['Trend / Month'] = growth_table['Trend / Month'].apply(lambda x: f"{x:+.2f}")
+    growth_table['Trend %'] = growth_table['Trend %'].apply(lambda x: f"{x:+.1f}%")
+    growth_table['YoY Growth'] = growth_table['YoY Growth'].apply(lambda x: "n/a" if pd.isna(x) else f"{x:+.0f}%")
+    growth_table.index = range(1, len(growth_table) + 1)
+    st.dataframe(growth_table, width='stretch')
+
+    # 3-month rolling average of the five fastest growing pincodes
+    st.line_chart(monthly_series.rolling_frame(top_growth['CPA_PIN_CODE'].head(5).to_numpy(), patient_type=type_filter))
+else:
+    st.info("Not enough monthly history to compute trends.")
+
 # Add color legend
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 🎨 Marker Colors")
 
 if display_mode == "Percentage":
-    st.sidebar.markdown("**Individual Pincodes & Clusters:**")
+    st.sidebar.markdown("**Individual Pincodes, Clusters, Hex Bins & Pincode Areas:**")
     st.sidebar.markdown("🔴 **Red:** ≥ 10%")
     st.sidebar.markdown("🟠 **Orange:** 5-10%")
     st.sidebar.markdown("🟢 **Green:** 1-5%")
     st.sidebar.markdown("🔵 **Blue:** < 1%")
 else:
-    st.sidebar.markdown("**Individual Pincodes & Clusters:**")
+    st.sidebar.markdown("**Individual Pincodes, Clusters, Hex Bins & Pincode Areas:**")
     st.sidebar.markdown("🔴 **Red:** > 1,000 patients")
     st.sidebar.markdown("🟠 **Orange:** 500-1,000 patients")
     st.sidebar.markdown("🟢 **Green:** 100-499 patients")
     st.sidebar.markdown("🔵 **Blue:** < 100 patients")
 
+if marker_detail is not None:
+    st.sidebar.markdown("⚪ **Dashed bubbles:** long tail of smaller pincodes, grouped on a coarser grid")
+
 # Patient type information
 st.sidebar.markdown("---")
 st.sidebar.markdown("### 📋 Patient Types")
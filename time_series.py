@@ -0,0 +1,122 @@
+"""
+Monthly registration time series per pincode.
+
+Registrations are counted into a dense pincode x month (x patient type)
+matrix with one bincount pass. Rolling means, year-over-year growth and
+least-squares trend slopes are then computed for every pincode at once with
+whole-matrix operations, which is what the "fastest growing pincodes" view
+in the dashboards is built on.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def rolling_mean(matrix, window=3):
+    """Trailing `window`-month mean along the month axis (first `window - 1` months are NaN)"""
+    cumulative = np.cumsum(np.pad(matrix.astype(float), ((0, 0), (1, 0))), axis=1)
+    means = np.full(matrix.shape, np.nan)
+    means[:, window - 1:] = (cumulative[:, window:] - cumulative[:, :-window]) / window
+    return means
+
+
+def yoy_growth(matrix):
+    """Percent change of the last 12 months over the 12 before them (NaN without a non-zero base)"""
+    if matrix.shape[1] < 24:
+        return np.full(matrix.shape[0], np.nan)
+    last_year = matrix[:, -12:].sum(axis=1)
+    prior_year = matrix[:, -24:-12].sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(prior_year > 0, (last_year - prior_year) / prior_year * 100, np.nan)
+
+
+def trend_slope(matrix):
+    """Least-squares slope (registrations per month) of every row against the month index"""
+    months = np.arange(matrix.shape[1], dtype=float)
+    centered = months - months.mean()
+    denominator = centered @ centered
+    if denominator == 0:
+        return np.zeros(matrix.shape[0])
+    # With a centered time axis the row means drop out of the normal equations
+    return (matrix @ centered) / denominator
+
+
+class MonthlySeries:
+    """Dense registration counts indexed by (pincode, month, patient type)"""
+
+    def __init__(self, df, type_column=None):
+        dated = df['RegistrationDate'].notna().to_numpy()
+        dates = df['RegistrationDate'].to_numpy()[dated]
+
+        pin_codes, pincodes = pd.factorize(df['CPA_PIN_CODE'].to_numpy()[dated], sort=True)
+        self.pincodes = np.asarray(pincodes)
+
+        if type_column is not None:
+            type_codes, types = pd.factorize(df[type_column].to_numpy()[dated], sort=True)
+            self.types = np.asarray(types)
+        else:
+            type_codes, self.types = np.zeros(len(dates), dtype=np.intp), np.array(['All'])
+
+        month_ordinals = dates.astype('datetime64[M]').astype(np.int64)
+        first_month = month_ordinals.min() if len(month_ordinals) else 0
+        month_codes = month_ordinals - first_month
+        n_months = int(month_codes.max()) + 1 if len(month_codes) else 0
+        first_period = pd.Timestamp(np.datetime64(int(first_month), 'M')).to_period('M')
+        self.months = pd.period_range(first_period, periods=n_months, freq='M')
+
+        shape = (len(self.pincodes), n_months, len(self.types))
+        flat_index = np.ravel_multi_index((pin_codes, month_codes, type_codes), shape)
+        self.counts = np.bincount(flat_index, minlength=np.prod(shape)).astype(np.int32).reshape(shape)
+
+        # The extract usually stops part-way through its last month; leave that
+        # month out of trends so it does not read as a sudden drop
+        last_date = pd.Timestamp(dates.max()) if len(dates) else None
+        partial = last_date is not None and not last_date.is_month_end
+        self.n_complete = n_months - 1 if partial else n_months
+
+    def matrix(self, patient_type=None):
+        """Pincode x complete-month counts, optionally for a single patient type"""
+        counts = self.counts[:, :self.n_complete, :]
+        if patient_type is None:
+            return counts.sum(axis=2)
+        matches = self.types == str(patient_type)
+        return counts[:, :, matches].sum(axis=2)
+
+    def growth_table(self, patient_type=None, window=12, min_monthly_avg=1.0):
+        """
+        Trend statistics for every pincode over the last `window` complete months.
+
+        Columns: trailing 3-month average, least-squares trend (registrations
+        per month), trend relative to the window average, and growth of the
+        last 12 months over the 12 before them. Pincodes averaging fewer than
+        `min_monthly_avg` registrations per month in the window are dropped.
+        Sorted by trend, fastest growing first.
+        """
+        matrix = self.matrix(patient_type)
+        recent = matrix[:, -window:]
+        window_avg = recent.mean(axis=1) if recent.shape[1] else np.zeros(len(matrix))
+        slope = trend_slope(recent)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative_trend = np.where(window_avg > 0, slope / window_avg * 100, np.nan)
+
+        table = pd.DataFrame({
+            'CPA_PIN_CODE': self.pincodes,
+            'recent_avg': rolling_mean(matrix, 3)[:, -1] if matrix.shape[1] >= 3 else np.nan,
+            'window_avg': window_avg,
+            'trend_per_month': slope,
+            'trend_pct': relative_trend,
+            'yoy_growth': yoy_growth(matrix),
+        })
+        table = table[table['window_avg'] >= min_monthly_avg]
+        return table.sort_values('trend_per_month', ascending=False).reset_index(drop=True)
+
+    def rolling_frame(self, pincodes, patient_type=None, window=3):
+        """Trailing `window`-month means for the given pincodes, one column per pincode, indexed by month"""
+        rows = np.searchsorted(self.pincodes, pincodes)
+        means = rolling_mean(self.matrix(patient_type)[rows], window)
+        return pd.DataFrame(
+            means.T,
+            index=self.months[:self.n_complete].to_timestamp(),
+            columns=[str(int(pincode)) for pincode in pincodes]
+        )